@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from debug_toolbar.settings import PANELS_DEFAULTS
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv("SECRET_KEY", "Generate custom security key")
@@ -89,3 +91,8 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
+
+DEBUG_TOOLBAR_PANELS = [
+    *PANELS_DEFAULTS,
+    "tree_menu.panels.TreeMenuPanel",
+]
@@ -4,5 +4,6 @@ from django.urls import include, path
 urlpatterns = [
     path("", include("example.urls")),
     path("admin/", admin.site.urls),
+    path("tree_menu/", include("tree_menu.urls")),
     path("__debug__/", include("debug_toolbar.urls")),
 ]
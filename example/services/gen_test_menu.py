@@ -1,6 +1,7 @@
 import random
 
-from tree_menu.models import TreeMenu, TreeMenuItem
+from tree_menu.models import TreeMenu
+from tree_menu.services import import_menu
 
 
 def get_item_for_tree(deep_count: int = 5, prefix: str = "Item "):
@@ -12,7 +13,7 @@ def get_item_for_tree(deep_count: int = 5, prefix: str = "Item "):
         siblings.append(
             {
                 "name": name,
-                "url": f"/example/{name}",
+                "url": f"/example/{name.replace(' ', '_')}",
                 "children": get_item_for_tree(deep_count=deep_count - 1, prefix=name)
                 if deep_count > 1
                 else None,
@@ -21,26 +22,8 @@ def get_item_for_tree(deep_count: int = 5, prefix: str = "Item "):
     return siblings
 
 
-def make_children_items(root_item, menu_items):
-    for item in menu_items:
-        menu_item = TreeMenuItem(
-            name=item["name"],
-            url=item["url"],
-            parent=root_item,
-            menu=root_item.menu,
-        )
-        menu_item.save()
-        if item["children"] is not None:
-            make_children_items(menu_item, item["children"])
-
-
 def make_menu_by_tree(menu_name, menu_items):
-    tree_menu_model = TreeMenu(name=menu_name)
-    tree_menu_model.save()
-    root_item = TreeMenuItem.objects.filter(menu=tree_menu_model, parent__isnull=True)[
-        0
-    ]
-    make_children_items(root_item, menu_items)
+    import_menu(menu_name, menu_items)
 
 
 def clear_all_menus():
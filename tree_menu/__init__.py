@@ -0,0 +1,3 @@
+from .rebuild import deferred_rebuild
+
+__all__ = ("deferred_rebuild",)
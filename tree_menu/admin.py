@@ -1,8 +1,156 @@
+import json
+from contextlib import nullcontext
+from functools import cached_property
+from typing import List, Optional
+
 from django import forms
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db.models import Exists, OuterRef, Q
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path
+from django.utils.html import format_html
 
+from .conf import menu_settings
 from .models import TreeMenu, TreeMenuItem
-from .services import AdminModelsItemMenuChoices
+from .rebuild import deferred_rebuild
+from .services import AdminModelsItemMenuChoices, menu_outline, restructure_menu
+
+
+def get_int_param(request, name: str) -> Optional[int]:
+    """Return integer GET parameter or None if it is missing or invalid."""
+    value = request.GET.get(name, "")
+    return int(value) if value.isdigit() else None
+
+
+def get_int_list_param(request, name: str) -> List[int]:
+    """Return list of integers from comma separated GET parameter."""
+    return [
+        int(value) for value in request.GET.get(name, "").split(",") if value.isdigit()
+    ]
+
+
+def has_children_annotation() -> Exists:
+    return Exists(
+        TreeMenuItem.objects.filter(
+            menu_id=OuterRef("menu_id"), parent_id=OuterRef("pk")
+        )
+    )
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator which counts not more than count_limit objects.
+
+    Count of bigger lists is estimated by count_limit, so it costs as reading of
+    count_limit index entries instead of the whole table.
+    """
+
+    count_limit = 10000
+
+    @cached_property
+    def count(self) -> int:
+        count: int = self.object_list.order_by()[: self.count_limit + 1].count()
+        self.estimated: bool = count > self.count_limit
+        return min(count, self.count_limit)
+
+
+class TreeChangeList(ChangeList):
+    """Changelist of menu items in tree order with keyset pagination.
+
+    Page is continuous range of (menu_id, tree order) after item from "after"
+    parameter, so pages are not read by OFFSET. Subtrees of items from "collapsed"
+    parameter are hidden by the query.
+    """
+
+    cursor_var = "after"
+    collapsed_var = "collapsed"
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor_id: Optional[int] = get_int_param(request, self.cursor_var)
+        self.collapsed_ids: List[int] = get_int_list_param(request, self.collapsed_var)
+        self.first_page_url: Optional[str] = None
+        self.next_page_url: Optional[str] = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for name in (self.cursor_var, self.collapsed_var):
+            lookup_params.pop(name, None)
+        return lookup_params
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        storage = TreeMenuItem.get_storage()
+        collapsed = TreeMenuItem.objects.filter(pk__in=self.collapsed_ids).only(
+            "id", "parent_id", "menu_id", *storage.tree_fields
+        )
+        for item in collapsed:
+            queryset = storage.exclude_descendants(queryset, item) | queryset.filter(
+                pk=item.pk
+            )
+        return queryset
+
+    def _after_cursor(self, queryset):
+        """Filter items after cursor item in ordering of changelist.
+
+        Ordering is (menu_id, *order_fields of storage, -pk), pk makes it unique.
+        """
+        ordering: list = [
+            (field.lstrip("-"), "lt" if field.startswith("-") else "gt")
+            for field in queryset.query.order_by
+        ]
+        fields: list = [field for field, _ in ordering]
+        values: Optional[tuple] = (
+            TreeMenuItem.objects.filter(pk=self.cursor_id).values_list(*fields).first()
+        )
+        if values is None:
+            return queryset
+        condition = Q()
+        for index, (field, lookup) in enumerate(ordering):
+            condition |= Q(
+                **dict(zip(fields[:index], values)),
+                **{f"{field}__{lookup}": values[index]},
+            )
+        return queryset.filter(condition)
+
+    def get_results(self, request):
+        super().get_results(request)
+        if (self.show_all and self.can_show_all) or not self.multi_page:
+            queryset = self.queryset
+        else:
+            queryset = self.queryset[: self.list_per_page + 1]
+            if self.cursor_id is not None:
+                queryset = self._after_cursor(self.queryset)[: self.list_per_page + 1]
+        result_list: list = list(
+            queryset.annotate(has_children=has_children_annotation())
+        )
+        if self.multi_page and len(result_list) > self.list_per_page:
+            result_list = result_list[: self.list_per_page]
+            self.next_page_url = self.get_query_string(
+                {self.cursor_var: result_list[-1].pk}
+            )
+        if self.cursor_id is not None:
+            self.first_page_url = self.get_query_string(remove=[self.cursor_var])
+        for item in result_list:
+            item.collapse_url = self._get_collapse_url(item)
+        self.result_list = result_list
+
+    def _get_collapse_url(self, item: TreeMenuItem) -> Optional[str]:
+        """Return url which toggles subtree of item."""
+        if not item.has_children:
+            return None
+        if item.pk in self.collapsed_ids:
+            ids = [pk for pk in self.collapsed_ids if pk != item.pk]
+        else:
+            ids = [*self.collapsed_ids, item.pk]
+        if not ids:
+            return self.get_query_string(remove=[self.collapsed_var])
+        return self.get_query_string(
+            {self.collapsed_var: ",".join(str(pk) for pk in ids)}
+        )
 
 
 class TreeMenuItemsFormAdmin(forms.ModelForm):
@@ -19,11 +167,22 @@ class TreeMenuItemsAdmin(admin.ModelAdmin):
     list_display = ("list_name", "_menu", "_url", "_level")
 
     form = TreeMenuItemsFormAdmin
+    paginator = EstimatedCountPaginator
+    # count of all items is not needed for tree changelist
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return TreeChangeList
 
     def list_name(self, obj):
         if obj.level == 1:
-            return f"{obj.name}"
-        return f"{(obj.level-1)*'⠀⠀⠀'}└── {obj.name}"
+            name = f"{obj.name}"
+        else:
+            name = f"{(obj.level-1)*'⠀⠀⠀'}└── {obj.name}"
+        collapse_url = getattr(obj, "collapse_url", None)
+        if collapse_url is None:
+            return name
+        return format_html('{} <a href="{}">±</a>', name, collapse_url)
 
     list_name.admin_order_field = None
 
@@ -47,10 +206,24 @@ class TreeMenuItemsAdmin(admin.ModelAdmin):
 
     _level.admin_order_field = None
 
+    def _tree_changes(self):
+        """Context of item changes, tree can be rebuilt in background after them."""
+        if menu_settings.ADMIN_BACKGROUND_REBUILD:
+            return deferred_rebuild(background=True)
+        return nullcontext()
+
     def save_model(self, request, obj, form, change):
         # Set obj`s menu from parent
         obj.menu = obj.parent.menu
-        super().save_model(request, obj, form, change)
+        with self._tree_changes():
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with self._tree_changes():
+            super().delete_model(request, obj)
+
+    def get_ordering(self, request):
+        return ("menu_id", *TreeMenuItem.get_storage().order_fields)
 
     def get_queryset(self, request):
         return (
@@ -61,7 +234,10 @@ class TreeMenuItemsAdmin(admin.ModelAdmin):
         )
 
     def render_change_form(self, request, context, *args, **kwargs):
-        menu_item_choicer = AdminModelsItemMenuChoices(kwargs.get("obj"))
+        # new item can be limited by menu from url: ?menu=<menu id>
+        menu_item_choicer = AdminModelsItemMenuChoices(
+            kwargs.get("obj"), menu_id=get_int_param(request, "menu")
+        )
         choices = menu_item_choicer.choices()
 
         context["adminform"].form.fields[
@@ -71,6 +247,85 @@ class TreeMenuItemsAdmin(admin.ModelAdmin):
 
         return super().render_change_form(request, context, *args, **kwargs)
 
+    def get_urls(self):
+        return [
+            path(
+                "children/",
+                self.admin_site.admin_view(self.children_view),
+                name="tree_menu_treemenuitem_children",
+            ),
+            path(
+                "tree/<int:menu_id>/",
+                self.admin_site.admin_view(self.tree_view),
+                name="tree_menu_treemenuitem_tree",
+            ),
+        ] + super().get_urls()
+
+    def children_view(self, request):
+        """Return one level of items for lazy loaded parent choices.
+
+        GET parameters:
+        parent - id of item for its children, roots of all menus without it;
+        exclude - id of item, its subtree can not be parent.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        storage = TreeMenuItem.get_storage()
+        queryset = (
+            TreeMenuItem.objects.filter(parent_id=get_int_param(request, "parent"))
+            .order_by("menu_id", *storage.order_fields)
+            .annotate(has_children=has_children_annotation())
+        )
+        excluded = TreeMenuItem.objects.filter(
+            pk=get_int_param(request, "exclude")
+        ).only("id", "parent_id", "menu_id", *storage.tree_fields)
+        for item in excluded:
+            queryset = storage.exclude_descendants(queryset, item)
+
+        return JsonResponse(
+            {
+                "results": [
+                    {
+                        "id": pk,
+                        "text": name,
+                        "level": level,
+                        "has_children": has_children,
+                    }
+                    for pk, name, level, has_children in queryset.values_list(
+                        "id", "name", "level", "has_children"
+                    )
+                ]
+            }
+        )
+
+    def tree_view(self, request, menu_id: int):
+        """Return outline of menu items or change parents of many items at once.
+
+        GET returns {"items": [{"id", "name", "children": [...]}]}, POST takes
+        the same json with new nesting of all items, it is applied in one
+        transaction with one rebuild of menu. Missing menu is 404 for both.
+        """
+        if request.method == "GET":
+            if not self.has_view_permission(request):
+                raise PermissionDenied
+            menu = get_object_or_404(TreeMenu, pk=menu_id)
+            return JsonResponse({"items": menu_outline(menu.pk)})
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["GET", "POST"])
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        menu = get_object_or_404(TreeMenu, pk=menu_id)
+
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict) or not isinstance(data.get("items"), list):
+                raise ValueError('Json object with "items" list is expected.')
+            moved: int = restructure_menu(menu.pk, data["items"])
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        return JsonResponse({"moved": moved})
+
 
 admin.site.register(TreeMenu)
 admin.site.register(TreeMenuItem, TreeMenuItemsAdmin)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TreemenuConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "tree_menu"
+
+    def ready(self):
+        from .services.tree_menu import warm_up_menus
+        from .signals import menu_invalidated
+
+        menu_invalidated.connect(warm_up_menus)
@@ -0,0 +1,521 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from django.core.cache import BaseCache, caches
+from django.urls import get_script_prefix, get_urlconf
+
+from .conf import menu_settings
+from .signals import menu_invalidated
+
+# versions are kept without timeout, prerendered menus are found by them
+VERSION_KEY = "tree_menu:version:{menu_key}"
+# format of pickled MenuStructure is a part of key, change it with new structure fields
+STRUCTURE_KEY = "tree_menu:structure:3:{menu_key}:{urls_key}:{version}"
+FRAGMENT_KEY = (
+    "tree_menu:fragment:{menu_key}:{urls_key}:{version}:{options}:{current_id}"
+)
+PRERENDERED_KEY = "tree_menu:prerendered:2:{menu_key}:{urls_key}:{version}"
+PRERENDERED_FILE = "{menu_key}.pickle"
+
+
+def get_cache() -> Optional[BaseCache]:
+    """Return cache backend for menus or None if caching is disabled."""
+    alias = menu_settings.CACHE_ALIAS
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def _menu_key(menu_name: str) -> str:
+    """Menu name can contain spaces and any symbols, so use its hash in keys."""
+    return hashlib.md5(menu_name.encode()).hexdigest()
+
+
+def url_context() -> tuple:
+    """Menus keep resolved urls and html with them, so cached menus are valid only
+    for url configuration and script prefix of current request.
+    """
+    return get_urlconf(), get_script_prefix()
+
+
+@lru_cache(maxsize=None)
+def _urls_key(context: tuple) -> str:
+    return hashlib.md5(repr(context).encode()).hexdigest()
+
+
+def _new_version() -> str:
+    return uuid.uuid4().hex
+
+
+def _version_keys(menu_names: Iterable[str]) -> Dict[str, str]:
+    return {VERSION_KEY.format(menu_key=_menu_key(name)): name for name in menu_names}
+
+
+def _structure_keys(
+    menu_names: Iterable[str], versions: dict, context: tuple
+) -> Dict[str, str]:
+    urls_key: str = _urls_key(context)
+    return {
+        STRUCTURE_KEY.format(
+            menu_key=_menu_key(name), urls_key=urls_key, version=versions.get(name)
+        ): name
+        for name in menu_names
+    }
+
+
+def get_menu_versions(menu_names: Iterable[str]) -> Dict[str, str]:
+    """Return current versions of menus, create new versions for missing ones."""
+    cache = get_cache()
+    if cache is None:
+        return {}
+    version_keys: dict = _version_keys(menu_names)
+    versions: dict = cache.get_many(version_keys)
+    missing: list = [key for key in version_keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_version(), None)
+        # other process can set version at the same time, so read it again
+        versions.update(cache.get_many(missing))
+    return {version_keys[key]: version for key, version in versions.items()}
+
+
+async def aget_menu_versions(menu_names: Iterable[str]) -> Dict[str, str]:
+    """Async version of get_menu_versions."""
+    cache = get_cache()
+    if cache is None:
+        return {}
+    version_keys: dict = _version_keys(menu_names)
+    versions: dict = await cache.aget_many(version_keys)
+    missing: list = [key for key in version_keys if key not in versions]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, _new_version(), None)
+        versions.update(await cache.aget_many(missing))
+    return {version_keys[key]: version for key, version in versions.items()}
+
+
+def _get_local_structures(
+    menu_names: Iterable[str],
+    now: float,
+    context: tuple,
+    lru: Optional["LRUCache"] = None,
+) -> Tuple[Dict[str, tuple], List[str]]:
+    """Return menus from process memory and names of menus which versions must be checked.
+
+    Menus checked less than VERSION_CHECK_INTERVAL seconds ago are used without check.
+    """
+    lru = lru or local_cache
+    interval: float = menu_settings.VERSION_CHECK_INTERVAL
+    entries: dict = {}
+    unchecked: list = []
+    for name in menu_names:
+        entry: Optional[tuple] = lru.get((name, context))
+        if entry is not None:
+            entries[name] = entry
+        if entry is None or now - entry[2] >= interval:
+            unchecked.append(name)
+    return entries, unchecked
+
+
+def _check_local_structures(
+    entries: Dict[str, tuple],
+    versions: dict,
+    now: float,
+    context: tuple,
+    lru: Optional["LRUCache"] = None,
+) -> Dict[str, tuple]:
+    """Return (version, structure) of local menus with current versions."""
+    lru = lru or local_cache
+    checked: dict = {}
+    for name, (version, structure, _) in entries.items():
+        if version == versions.get(name):
+            lru.set((name, context), (version, structure, now))
+            checked[name] = (version, structure)
+    return checked
+
+
+def _set_local_structures(
+    structures: dict,
+    versions: dict,
+    now: float,
+    context: tuple,
+    lru: Optional["LRUCache"] = None,
+) -> Dict[str, tuple]:
+    """Replace local menus by new versions, every menu is swapped by one assignment."""
+    lru = lru or local_cache
+    loaded: dict = {}
+    for name, structure in structures.items():
+        loaded[name] = (versions.get(name), structure)
+        lru.set((name, context), (versions.get(name), structure, now))
+    return loaded
+
+
+def get_menu_structures(
+    menu_names: Iterable[str],
+    builder: Callable[[List[str]], Dict[str, Any]],
+    sources: Optional[dict] = None,
+) -> Dict[str, Any]:
+    """Return menus versions and structures from cache, build and cache missing ones.
+
+    builder gets list of missing menu names and returns dict with structures by name.
+    Result is dict with (version, structure) by name, version is None without cache.
+    Structures are kept in process memory, so usually only versions are read from cache.
+    sources: dict to fill with source of structure by name (local, shared, built).
+    """
+    menu_names = list(menu_names)
+    cache = get_cache()
+    if sources is None:
+        sources = {}
+    if cache is None:
+        sources.update(dict.fromkeys(menu_names, "built"))
+        return {
+            name: (None, structure) for name, structure in builder(menu_names).items()
+        }
+
+    now: float = time.monotonic()
+    context: tuple = url_context()
+    entries, unchecked = _get_local_structures(menu_names, now, context)
+    loaded: dict = {
+        name: entry[:2] for name, entry in entries.items() if name not in unchecked
+    }
+    sources.update(dict.fromkeys(entries, "local"))
+    if unchecked:
+        versions: dict = get_menu_versions(unchecked)
+        loaded.update(
+            _check_local_structures(
+                {name: entries[name] for name in unchecked if name in entries},
+                versions,
+                now,
+                context,
+            )
+        )
+        missing: list = [name for name in unchecked if name not in loaded]
+        if missing:
+            structure_keys: dict = _structure_keys(missing, versions, context)
+            structures: dict = {
+                structure_keys[key]: structure
+                for key, structure in cache.get_many(structure_keys).items()
+            }
+            not_cached: list = [name for name in missing if name not in structures]
+            sources.update(dict.fromkeys(missing, "shared"))
+            sources.update(dict.fromkeys(not_cached, "built"))
+            if not_cached:
+                built: dict = builder(not_cached)
+                cache.set_many(
+                    {
+                        key: built[name]
+                        for key, name in structure_keys.items()
+                        if name in built
+                    },
+                    menu_settings.CACHE_TIMEOUT,
+                )
+                structures.update(built)
+            loaded.update(_set_local_structures(structures, versions, now, context))
+    return {name: loaded[name] for name in menu_names}
+
+
+async def aget_menu_structures(
+    menu_names: Iterable[str],
+    builder: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+    sources: Optional[dict] = None,
+) -> Dict[str, Any]:
+    """Async version of get_menu_structures, builder is a coroutine function."""
+    menu_names = list(menu_names)
+    cache = get_cache()
+    if sources is None:
+        sources = {}
+    if cache is None:
+        sources.update(dict.fromkeys(menu_names, "built"))
+        built: dict = await builder(menu_names)
+        return {name: (None, structure) for name, structure in built.items()}
+
+    now: float = time.monotonic()
+    context: tuple = url_context()
+    entries, unchecked = _get_local_structures(menu_names, now, context)
+    loaded: dict = {
+        name: entry[:2] for name, entry in entries.items() if name not in unchecked
+    }
+    sources.update(dict.fromkeys(entries, "local"))
+    if unchecked:
+        versions: dict = await aget_menu_versions(unchecked)
+        loaded.update(
+            _check_local_structures(
+                {name: entries[name] for name in unchecked if name in entries},
+                versions,
+                now,
+                context,
+            )
+        )
+        missing: list = [name for name in unchecked if name not in loaded]
+        if missing:
+            structure_keys: dict = _structure_keys(missing, versions, context)
+            structures: dict = {
+                structure_keys[key]: structure
+                for key, structure in (await cache.aget_many(structure_keys)).items()
+            }
+            not_cached: list = [name for name in missing if name not in structures]
+            sources.update(dict.fromkeys(missing, "shared"))
+            sources.update(dict.fromkeys(not_cached, "built"))
+            if not_cached:
+                built: dict = await builder(not_cached)
+                await cache.aset_many(
+                    {
+                        key: built[name]
+                        for key, name in structure_keys.items()
+                        if name in built
+                    },
+                    menu_settings.CACHE_TIMEOUT,
+                )
+                structures.update(built)
+            loaded.update(_set_local_structures(structures, versions, now, context))
+    return {name: loaded[name] for name in menu_names}
+
+
+def invalidate_menu(*menu_names: str) -> None:
+    """Switch menus to new versions, old cached structures become unreachable.
+
+    Other processes see new versions at next check and replace their local structures.
+    """
+    cache = get_cache()
+    if not menu_names:
+        return
+    local_cache.delete_menus(menu_names)
+    prerendered_cache.delete_menus(menu_names)
+    if cache is not None:
+        cache.set_many(
+            {
+                VERSION_KEY.format(menu_key=_menu_key(name)): _new_version()
+                for name in menu_names
+            },
+            None,
+        )
+    menu_invalidated.send(sender=None, menu_names=menu_names)
+
+
+class LRUCache:
+    """Thread safe in-process cache with bounded size, least recently used values are evicted."""
+
+    def __init__(self, size_setting: str):
+        self.size_setting = size_setting
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self) -> int:
+        return getattr(menu_settings, self.size_setting)
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        max_size: int = self.max_size
+        if max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_menus(self, menu_names: Iterable[str]) -> None:
+        """Delete values with keys starting with one of menu names."""
+        menu_names = set(menu_names)
+        with self._lock:
+            for key in [key for key in self._data if key[0] in menu_names]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# (version, structure, time of version check) of menus by (menu name, url context)
+local_cache = LRUCache("LOCAL_CACHE_SIZE")
+
+# rendered html of menus by (menu name, url context, menu version, current item id, *options)
+fragment_cache = LRUCache("FRAGMENT_CACHE_SIZE")
+
+# (version, prerendered menu or None, time of version check) by (menu name, url context)
+prerendered_cache = LRUCache("LOCAL_CACHE_SIZE")
+
+
+def _fragment_key(
+    menu_name: str, version: str, current_id: Optional[int], options: tuple
+) -> str:
+    return FRAGMENT_KEY.format(
+        menu_key=_menu_key(menu_name),
+        urls_key=_urls_key(url_context()),
+        version=version,
+        options=":".join(map(str, options)),
+        current_id=current_id,
+    )
+
+
+def get_menu_fragment(
+    menu_name: str,
+    version: Optional[str],
+    current_id: Optional[int],
+    options: tuple = (),
+) -> Optional[str]:
+    """Return rendered menu html, versions are unknown without cache.
+
+    With TREE_MENU_FRAGMENT_WARM_UP html missing in process memory is read from
+    shared cache, warm_up_menus writes it there after change of menu.
+    """
+    if version is None:
+        return None
+    key: tuple = (menu_name, url_context(), version, current_id, *options)
+    html: Optional[str] = fragment_cache.get(key)
+    if html is None and menu_settings.FRAGMENT_WARM_UP:
+        html = get_cache().get(_fragment_key(menu_name, version, current_id, options))
+        if html is not None:
+            fragment_cache.set(key, html)
+    return html
+
+
+def set_menu_fragment(
+    menu_name: str,
+    version: Optional[str],
+    current_id: Optional[int],
+    html: str,
+    options: tuple = (),
+) -> None:
+    if version is None:
+        return
+    fragment_cache.set((menu_name, url_context(), version, current_id, *options), html)
+
+
+def set_shared_menu_fragments(
+    menu_name: str, version: Optional[str], fragments: dict, options: tuple = ()
+) -> None:
+    """Save rendered menu html by current item id to shared cache for all processes."""
+    cache = get_cache()
+    if cache is None or version is None:
+        return
+    cache.set_many(
+        {
+            _fragment_key(menu_name, version, current_id, options): html
+            for current_id, html in fragments.items()
+        },
+        menu_settings.CACHE_TIMEOUT,
+    )
+
+
+def _prerendered_key(menu_name: str, version: str) -> str:
+    return PRERENDERED_KEY.format(
+        menu_key=_menu_key(menu_name),
+        urls_key=_urls_key(url_context()),
+        version=version,
+    )
+
+
+def _read_prerendered_file(menu_name: str) -> Optional[Any]:
+    """Return prerendered menu from TREE_MENU_PRERENDERED_DIR."""
+    directory: Optional[str] = menu_settings.PRERENDERED_DIR
+    if directory is None:
+        return None
+    try:
+        with open(
+            os.path.join(
+                directory, PRERENDERED_FILE.format(menu_key=_menu_key(menu_name))
+            ),
+            "rb",
+        ) as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def get_prerendered_menu(
+    menu_name: str, content_key: Callable[[], str]
+) -> Optional[Any]:
+    """Return menu prerendered for current version of menu or None.
+
+    Prerendered menus are read from cache by menu version. Files of
+    TREE_MENU_PRERENDERED_DIR outlive versions after cache flush and restart, menu
+    from file is used when its content key is key of current menu, content_key
+    callable loads menu to get it. Prerendered menus are kept in process memory,
+    absence of prerendered menu is kept too.
+    """
+    cache = get_cache()
+    if cache is None or not menu_settings.PRERENDERED:
+        return None
+    now: float = time.monotonic()
+    context: tuple = url_context()
+    entries, unchecked = _get_local_structures(
+        [menu_name], now, context, lru=prerendered_cache
+    )
+    if not unchecked:
+        return entries[menu_name][1]
+    versions: dict = get_menu_versions([menu_name])
+    checked: dict = _check_local_structures(
+        entries, versions, now, context, lru=prerendered_cache
+    )
+    if not checked:
+        key: str = _prerendered_key(menu_name, versions[menu_name])
+        prerendered = cache.get(key)
+        if prerendered is None:
+            prerendered = _read_prerendered_file(menu_name)
+            if (
+                prerendered is not None
+                and getattr(prerendered, "content_key", None) == content_key()
+            ):
+                cache.set(key, prerendered, menu_settings.CACHE_TIMEOUT)
+            else:
+                prerendered = None
+        checked = _set_local_structures(
+            {menu_name: prerendered}, versions, now, context, lru=prerendered_cache
+        )
+    return checked[menu_name][1]
+
+
+def set_prerendered_menu(
+    menu_name: str,
+    version: Optional[str],
+    prerendered: Any,
+    directory: Optional[str] = None,
+    shared: bool = True,
+) -> None:
+    """Save prerendered menu to file in directory if it is given and to shared cache.
+
+    shared: False for cache in memory of current process, it is useless for others.
+    """
+    if directory is not None:
+        path: str = os.path.join(
+            directory, PRERENDERED_FILE.format(menu_key=_menu_key(menu_name))
+        )
+        with open(path, "wb") as file:
+            pickle.dump(prerendered, file)
+    cache = get_cache()
+    if shared and cache is not None and version is not None:
+        cache.set(
+            _prerendered_key(menu_name, version),
+            prerendered,
+            menu_settings.CACHE_TIMEOUT,
+        )
+    prerendered_cache.delete_menus([menu_name])
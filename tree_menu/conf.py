@@ -0,0 +1,41 @@
+from django.conf import settings
+
+
+class TreeMenuSettings:
+    """Access to ``TREE_MENU_*`` project settings with app defaults."""
+
+    defaults: dict = {
+        # cache alias for menu structures, None disables caching
+        "CACHE_ALIAS": "default",
+        # seconds to keep cached menu structures
+        "CACHE_TIMEOUT": 60 * 60 * 24,
+        # max count of rendered menus kept in process memory, 0 disables it
+        "FRAGMENT_CACHE_SIZE": 1000,
+        # max count of rendered menus of every changed menu written to shared cache
+        # after change, top items go first, 0 disables it
+        "FRAGMENT_WARM_UP": 0,
+        # max count of menu structures kept in process memory, 0 disables it
+        "LOCAL_CACHE_SIZE": 100,
+        # seconds to trust local menu structures without reading versions from cache
+        "VERSION_CHECK_INTERVAL": 0,
+        # class of storage for tree of menu items
+        "STORAGE": "tree_menu.storages.NestedSetStorage",
+        # item with the longest url prefix of page is current, when no item has page url
+        "URL_PREFIX_MATCH": False,
+        # admin saves and deletes items without tree maintenance, menu is rebuilt by worker thread
+        "ADMIN_BACKGROUND_REBUILD": False,
+        # draw_menu uses menus of prerender_menus command for current menu versions
+        "PRERENDERED": False,
+        # directory with prerendered menus, they are read if cache has not them
+        "PRERENDERED_DIR": None,
+        # template of draw_menu tag, None outputs menu html without template
+        "TEMPLATE": None,
+    }
+
+    def __getattr__(self, name: str):
+        if name not in self.defaults:
+            raise AttributeError(f"Invalid tree menu setting: {name}")
+        return getattr(settings, f"TREE_MENU_{name}", self.defaults[name])
+
+
+menu_settings = TreeMenuSettings()
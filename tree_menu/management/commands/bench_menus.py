@@ -0,0 +1,146 @@
+import json
+import platform
+from typing import Optional
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from ...conf import menu_settings
+from ...models import TreeMenuItem
+from ...services.benchmark import SHAPES, bench_load, bench_menu
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark render, rebuild, admin choices and saves on generated menus "
+        "or render under concurrent requests, results are written as json."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--shape", choices=SHAPES, action="append", help="Menu shapes, default all."
+        )
+        parser.add_argument("--size", type=int, default=1000, help="Items in menu.")
+        parser.add_argument("--depth", type=int, default=10, help="Balanced depth.")
+        parser.add_argument(
+            "--fanout", type=int, default=5, help="Balanced children per item."
+        )
+        parser.add_argument(
+            "--storage",
+            help="Class of tree storage, default is TREE_MENU_STORAGE setting.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument(
+            "--load",
+            action="store_true",
+            help="Measure requests per second of sync and async render of pages "
+            "with all menus under concurrent requests instead of operations.",
+        )
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("-o", "--output", help="Path to json file with results.")
+        parser.add_argument(
+            "--compare", help="Path to json file of previous run to compare with."
+        )
+
+    def handle(self, *args, **options):
+        if options["size"] < 2 or options["repeat"] < 1:
+            raise CommandError("Size must be at least 2 and repeat at least 1.")
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("Requests and concurrency must be at least 1.")
+
+        previous: dict = {}
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as file:
+                previous = json.load(file)["results"]
+
+        storage: str = options["storage"] or menu_settings.STORAGE
+        results: dict = {}
+        with override_settings(TREE_MENU_STORAGE=storage):
+            max_level: Optional[int] = TreeMenuItem.get_storage().max_level
+            if (
+                "deep" in (options["shape"] or SHAPES)
+                and max_level is not None
+                and options["size"] > max_level
+            ):
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"Deep menu is limited to {max_level} levels by storage, "
+                        "the rest of items are siblings on the last level."
+                    )
+                )
+            if options["load"]:
+                results["load"] = bench_load(
+                    options["shape"] or list(SHAPES),
+                    options["size"],
+                    options["depth"],
+                    options["fanout"],
+                    options["seed"],
+                    options["requests"],
+                    options["concurrency"],
+                )
+            else:
+                for shape in options["shape"] or SHAPES:
+                    results[shape] = bench_menu(
+                        shape,
+                        options["size"],
+                        options["depth"],
+                        options["fanout"],
+                        options["seed"],
+                        options["repeat"],
+                    )
+            for shape, operations in results.items():
+                for operation, stats in operations.items():
+                    self.stdout.write(
+                        self._format_line(
+                            shape,
+                            operation,
+                            stats,
+                            previous.get(shape, {}).get(operation),
+                        )
+                    )
+
+        report: dict = {
+            "params": {
+                "storage": storage,
+                **{
+                    key: options[key]
+                    for key in (
+                        "size",
+                        "depth",
+                        "fanout",
+                        "seed",
+                        "repeat",
+                        "requests",
+                        "concurrency",
+                    )
+                },
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(
+                self.style.SUCCESS(f"Results saved to {options['output']}")
+            )
+
+    @staticmethod
+    def _format_line(shape, operation, stats, previous) -> str:
+        key = "median_ms" if "median_ms" in stats else "ms"
+        line = f"{shape:<9} {operation:<20} {stats[key]:>10.3f} ms"
+        if "queries" in stats:
+            line += f" {stats['queries']:>5} queries"
+        if "rps" in stats:
+            line += f" {stats['rps']:>9.1f} requests/s"
+        if previous and previous.get(key):
+            line += f"  x{stats[key] / previous[key]:.2f}"
+        return line
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import TreeMenu
+from ...services import export_menu
+
+
+class Command(BaseCommand):
+    help = "Export tree menu to json with nested items."
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", help="Menu name.")
+        parser.add_argument(
+            "-o", "--output", help="Path to json file, default is stdout."
+        )
+
+    def handle(self, *args, **options):
+        if not TreeMenu.objects.filter(name=options["name"]).exists():
+            raise CommandError(f"Tree menu <{options['name']}> not found.")
+
+        if options["output"] is None:
+            for chunk in export_menu(options["name"]):
+                self.stdout.write(chunk, ending="")
+            return
+
+        with open(options["output"], "w", encoding="utf-8") as file:
+            file.writelines(export_menu(options["name"]))
@@ -0,0 +1,48 @@
+import json
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from ...services import import_menu
+
+
+class Command(BaseCommand):
+    help = "Import tree menu from json file with nested items."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path to json file, '-' for stdin.")
+        parser.add_argument("--name", help="Menu name, default is name from file.")
+        parser.add_argument(
+            "--replace", action="store_true", help="Replace existing menu."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options["path"] == "-":
+                data = json.load(sys.stdin)
+            else:
+                with open(options["path"], encoding="utf-8") as file:
+                    data = json.load(file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Can not read menu: {e}")
+        if not isinstance(data, dict):
+            raise CommandError("Menu must be an object with name and items.")
+
+        menu_name = options["name"] or data.get("name")
+        if not menu_name or not isinstance(menu_name, str):
+            raise CommandError("Menu name is required.")
+
+        try:
+            menu = import_menu(
+                menu_name, data.get("items", []), replace=options["replace"]
+            )
+        except (ValueError, ValidationError) as e:
+            raise CommandError(e)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Tree menu <{menu.name}> imported with "
+                f"{menu.menu_tree_items.count() - 1} items."
+            )
+        )
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
+
+import django
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ...cache import get_cache, set_prerendered_menu
+from ...models import TreeMenu
+from ...services.tree_menu import prerender_menu
+
+
+def _init_worker():
+    # spawned workers import nothing of the project, forked ones share db connections
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Render menus for every current item to cache and directory, "
+        "draw_menu uses them with TREE_MENU_PRERENDERED setting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help="Menu names, default all menus.")
+        parser.add_argument(
+            "-o", "--output", help="Directory for files of prerendered menus."
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Count of processes to render menus, default 1.",
+        )
+
+    def handle(self, *args, **options):
+        cache = get_cache()
+        if cache is None:
+            raise CommandError(
+                "Prerendered menus need menu versions, set TREE_MENU_CACHE_ALIAS."
+            )
+        # menus in cache of this process are lost with it, so only files are written
+        self.shared: bool = not isinstance(cache, (LocMemCache, DummyCache))
+        if not self.shared and options["output"] is None:
+            raise CommandError(
+                f"{type(cache).__name__} is not shared with other processes, "
+                "use shared cache or -o directory."
+            )
+        if options["processes"] < 1:
+            raise CommandError("Processes must be at least 1.")
+
+        names = list(TreeMenu.objects.order_by("name").values_list("name", flat=True))
+        if options["names"]:
+            missing = set(options["names"]) - set(names)
+            if missing:
+                raise CommandError(
+                    f"Tree menus not found: {', '.join(sorted(missing))}"
+                )
+            names = [name for name in names if name in options["names"]]
+        if options["output"] is not None:
+            os.makedirs(options["output"], exist_ok=True)
+
+        if options["processes"] == 1:
+            self._save(names, map(prerender_menu, names), options["output"])
+            return
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=options["processes"], initializer=_init_worker
+        ) as executor:
+            self._save(
+                names,
+                executor.map(prerender_menu, names, chunksize=4),
+                options["output"],
+            )
+
+    def _save(self, names: list, results: Iterable[tuple], output: Optional[str]):
+        for name, (version, prerendered) in zip(names, results):
+            set_prerendered_menu(name, version, prerendered, output, self.shared)
+            self.stdout.write(
+                f"Tree menu <{name}> prerendered with {len(prerendered)} variants."
+            )
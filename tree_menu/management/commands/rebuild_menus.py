@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import TreeMenu, TreeMenuItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild tree values of menus for current TREE_MENU_STORAGE, "
+        "it is needed after change of storage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help="Menu names, default all menus.")
+
+    def handle(self, *args, **options):
+        menus = TreeMenu.objects.order_by("name")
+        if options["names"]:
+            menus = menus.filter(name__in=options["names"])
+            missing = set(options["names"]) - {menu.name for menu in menus}
+            if missing:
+                raise CommandError(
+                    f"Tree menus not found: {', '.join(sorted(missing))}"
+                )
+
+        for menu in menus:
+            TreeMenuItem.rebuild_menu(menu.pk)
+            self.stdout.write(f"Tree menu <{menu.name}> rebuilt.")
@@ -0,0 +1,52 @@
+import time
+from typing import Iterable, Optional
+
+from django.db import connection
+
+from .signals import menu_metrics
+
+
+class PhaseTimer:
+    """Measure phase of menu loading or rendering and send it by menu_metrics signal.
+
+    Nothing is measured without signal receivers, so timer is cheap in production.
+    info: counters of phase, they are sent as signal args.
+    """
+
+    def __init__(self, phase: str, menu_names: Iterable[str], count_queries=False):
+        self.phase = phase
+        self.menu_names = menu_names
+        self.count_queries = count_queries
+        self.enabled = False
+        self.info: dict = {}
+        self._start: float = 0
+        self._wrapper: Optional[object] = None
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.info["queries"] += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self) -> "PhaseTimer":
+        self.enabled = menu_metrics.has_listeners()
+        if self.enabled:
+            if self.count_queries:
+                self.info["queries"] = 0
+                self._wrapper = connection.execute_wrapper(self._count_query)
+                self._wrapper.__enter__()
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.enabled:
+            return
+        duration: float = time.perf_counter() - self._start
+        if self._wrapper is not None:
+            self._wrapper.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            menu_metrics.send(
+                sender=None,
+                phase=self.phase,
+                menu_names=tuple(self.menu_names),
+                duration=duration,
+                **self.info,
+            )
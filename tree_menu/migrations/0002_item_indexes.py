@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tree_menu", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="treemenuitem",
+            index=models.Index(
+                fields=["menu", "left_value"], name="tree_menu_item_menu_left"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="treemenuitem",
+            index=models.Index(
+                fields=["menu", "parent"], name="tree_menu_item_menu_parent"
+            ),
+        ),
+    ]
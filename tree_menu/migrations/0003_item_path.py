@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tree_menu", "0002_item_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="treemenuitem",
+            name="path",
+            field=models.CharField(default="", editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="treemenuitem",
+            index=models.Index(
+                fields=["menu", "path"], name="tree_menu_item_menu_path"
+            ),
+        ),
+    ]
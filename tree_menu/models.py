@@ -1,12 +1,18 @@
 import re
+from functools import partial
+from typing import Optional
 
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models.expressions import RawSQL
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.urls import exceptions, reverse
 
+from .cache import invalidate_menu
+from .rebuild import get_deferred_menus
+from .storages import TreeStorage, get_tree_storage
+
 
 def item_menu_url_validator(value: str):
     """Validated url value."""
@@ -32,9 +38,54 @@ def item_menu_url_validator(value: str):
 class TreeMenu(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # need for invalidate cache of old name after rename, deferred name is not
+        # read here, its loading creates new instance and it would load it again
+        self.original_name = self.__dict__.get("name")
+
     def __str__(self):
         return f"{self.name}"
 
+    def _load_original_name(self) -> None:
+        """Load original name of menu loaded with deferred name."""
+        if self.original_name is None and not self._state.adding:
+            self.original_name = (
+                type(self)
+                ._base_manager.filter(pk=self.pk)
+                .values_list("name", flat=True)
+                .first()
+            )
+
+    def save(self, *args, **kwargs):
+        self._load_original_name()
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self._load_original_name()
+        if "name" in self.get_deferred_fields():
+            self.name = self.original_name
+        return super().delete(*args, **kwargs)
+
+    @classmethod
+    def invalidate_cache(cls, menu_id):
+        """Invalidate cached structure of menu by menu id."""
+        menu_names = cls.objects.filter(pk=menu_id).values_list("name", flat=True)
+        transaction.on_commit(partial(invalidate_menu, *menu_names))
+
+    @classmethod
+    def lock_menus(cls, *menu_ids) -> None:
+        """Lock rows of menus until end of transaction, so changes of their trees
+        are made one by one. Menus are locked in order of ids to avoid deadlocks.
+        """
+        menu_ids = sorted({menu_id for menu_id in menu_ids if menu_id is not None})
+        list(
+            cls.objects.select_for_update()
+            .filter(pk__in=menu_ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
 
 class TreeMenuItem(models.Model):
     name = models.CharField(max_length=50)
@@ -55,7 +106,8 @@ class TreeMenuItem(models.Model):
     right_value = models.IntegerField(default=-1)
     level = models.IntegerField(default=-1)
 
-    __original_menu_id = None
+    # materialized path, it is maintained by MaterializedPathStorage
+    path = models.CharField(max_length=255, default="", editable=False)
 
     class Meta:
         unique_together = (
@@ -63,11 +115,20 @@ class TreeMenuItem(models.Model):
             "url",
         )
         ordering = ("menu_id", "left_value")
+        indexes = [
+            models.Index(
+                fields=["menu", "left_value"], name="tree_menu_item_menu_left"
+            ),
+            models.Index(fields=["menu", "parent"], name="tree_menu_item_menu_parent"),
+            models.Index(fields=["menu", "path"], name="tree_menu_item_menu_path"),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # need for check to change or create object
-        self.__original_parent_id = self.parent_id
+        # need for check to change or create object, deferred fields are not read
+        # here, their loading creates new instance and it would load them again
+        self.__original_parent_id = self.__dict__.get("parent_id", DEFERRED)
+        self.__original_menu_id = self.__dict__.get("menu_id", DEFERRED)
         self.__original_pk = self.pk
 
     @property
@@ -79,50 +140,101 @@ class TreeMenuItem(models.Model):
     def __str__(self):
         return self.full_name
 
+    @classmethod
+    def get_storage(cls) -> TreeStorage:
+        """Return storage of tree fields selected by TREE_MENU_STORAGE setting."""
+        return get_tree_storage(cls)
+
+    def _load_original_tree_ids(self) -> None:
+        """Load original parent and menu of item loaded with deferred fields."""
+        if self._state.adding or DEFERRED not in (
+            self.__original_parent_id,
+            self.__original_menu_id,
+        ):
+            return
+        self.__original_parent_id, self.__original_menu_id = (
+            type(self)
+            ._base_manager.filter(pk=self.pk)
+            .values_list("parent_id", "menu_id")
+            .get()
+        )
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.pk is None or self.parent_id != self.__original_parent_id:
-            TreeMenuItem.rebuild_menu(self.menu_id)
+        storage: TreeStorage = self.get_storage()
+        # ids of menus to rebuild later inside deferred_rebuild block
+        deferred: Optional[set] = get_deferred_menus()
+        with transaction.atomic():
+            self._load_original_tree_ids()
+            old_menu_id = self.__original_menu_id
+            if (
+                self._state.adding
+                or self.parent_id != self.__original_parent_id
+                or self.menu_id != old_menu_id
+            ):
+                # tree values are read and shifted below, concurrent saves must wait
+                TreeMenu.lock_menus(self.menu_id, old_menu_id)
+            if self._state.adding:
+                if deferred is None or self.parent_id is None:
+                    storage.insert_node(self)
+                else:
+                    deferred.add(self.menu_id)
+            elif (
+                self.parent_id != self.__original_parent_id
+                or self.menu_id != old_menu_id
+            ):
+                if deferred is None:
+                    storage.move_node(self, old_menu_id)
+                else:
+                    storage.defer_move(self, old_menu_id)
+                    deferred.update({self.menu_id, old_menu_id})
+            elif kwargs.get("update_fields") is None:
+                # tree values in memory can be outdated after changes of other items
+                deferred_fields = self.get_deferred_fields()
+                kwargs["update_fields"] = [
+                    field.name
+                    for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.name not in storage.tree_fields
+                    and field.attname not in deferred_fields
+                ]
+            super().save(*args, **kwargs)
+            if (
+                deferred is None
+                and old_menu_id is not None
+                and old_menu_id != self.menu_id
+            ):
+                TreeMenu.invalidate_cache(old_menu_id)
+        self.__original_parent_id = self.parent_id
+        self.__original_menu_id = self.menu_id
 
-    @classmethod
-    def get_descendants(cls, node):
-        """Returns a queryset of all descendants of a node using a single SELECT statement."""
-        sql = """
-            WITH RECURSIVE descendants(id, name, url, menu_id, parent_id) AS (
-                SELECT id, name, url, menu_id, parent_id FROM {table} WHERE id = %s
-                UNION ALL
-                SELECT {table}.id, {table}.name, {table}.url, {table}.menu_id, {table}.parent_id FROM descendants
-                JOIN {table} ON descendants.id = {table}.parent_id
+    def delete(self, *args, **kwargs):
+        deferred: Optional[set] = get_deferred_menus()
+        if deferred is not None:
+            deferred.add(self.menu_id)
+            return super().delete(*args, **kwargs)
+        with transaction.atomic():
+            TreeMenu.lock_menus(self.menu_id)
+            return self.get_storage().delete_node(
+                self, partial(super().delete, *args, **kwargs)
             )
-            SELECT id FROM descendants 
-        """.format(
-            table=cls._meta.db_table
-        )
 
-        return cls.objects.filter(id__in=RawSQL(sql, [node.id]))
+    @classmethod
+    def get_descendants(cls, node):
+        """Returns a queryset of node and all its descendants using a single SELECT statement."""
+        return cls.get_storage().descendants(node)
 
     @classmethod
-    def rebuild_menu(cls, menu_id):
-        lft = 1
-        level = 0
-        # Get the root nodes
-        root_obj = cls.objects.filter(parent=None, menu_id=menu_id)
-        cls._build_menu_item(root_obj[0], lft, level, menu_id)
+    def get_ancestors(cls, node):
+        """Returns a queryset of node and all its ancestors using a single SELECT statement."""
+        return cls.get_storage().ancestors(node)
 
     @classmethod
-    def _build_menu_item(cls, obj, lft, level, menu_id):
-        obj.left_value = lft
-        obj.menu_id = menu_id
-        obj.level = level
-        lft += 1
-        level += 1
-        rght = lft
-        for child in obj.children.all().order_by("name"):
-            rght = cls._build_menu_item(child, lft, level, menu_id)
-            lft = rght + 1
-        obj.right_value = rght
-        obj.save()
-        return rght + 1
+    def rebuild_menu(cls, menu_id):
+        """Recalculate tree values for all menu`s items."""
+        with transaction.atomic():
+            TreeMenu.lock_menus(menu_id)
+            cls.get_storage().rebuild(menu_id)
+            TreeMenu.invalidate_cache(menu_id)
 
 
 @receiver(post_save, sender=TreeMenu)
@@ -136,3 +248,22 @@ def save_tree_menu(sender, instance, created, **kwargs):
         root_child = TreeMenuItem.objects.filter(menu=instance, parent__isnull=True)[0]
         root_child.name = instance.name
         root_child.save()
+
+
+@receiver([post_save, post_delete], sender=TreeMenu)
+def invalidate_tree_menu_cache(sender, instance, **kwargs):
+    menu_names = {instance.name, instance.original_name}
+    transaction.on_commit(partial(invalidate_menu, *menu_names))
+    instance.original_name = instance.name
+
+
+@receiver([post_save, post_delete], sender=TreeMenuItem)
+def invalidate_tree_menu_item_cache(sender, instance, **kwargs):
+    deferred: Optional[set] = get_deferred_menus()
+    if deferred is not None:
+        # cache is invalidated once by rebuild of menu at exit of deferred block
+        deferred.add(instance.menu_id)
+    elif TreeMenuItem.menu.is_cached(instance):
+        transaction.on_commit(partial(invalidate_menu, instance.menu.name))
+    else:
+        TreeMenu.invalidate_cache(instance.menu_id)
@@ -0,0 +1,71 @@
+from collections import defaultdict
+
+from asgiref.local import Local
+from debug_toolbar.panels import Panel
+
+from .signals import menu_metrics
+
+
+class TreeMenuPanel(Panel):
+    """Debug toolbar panel with timings and counters of tree menus.
+
+    Add "tree_menu.panels.TreeMenuPanel" to DEBUG_TOOLBAR_PANELS.
+    """
+
+    title = "Tree menu"
+    template = "tree_menu_panel.html"
+
+    # panel of current request (thread or async task)
+    _context_locals = Local()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events: list = []
+
+    @classmethod
+    def ready(cls):
+        menu_metrics.connect(cls._receive_metrics, dispatch_uid="tree_menu_panel")
+
+    @classmethod
+    def _receive_metrics(cls, sender, signal, phase, menu_names, duration, **info):
+        panel = getattr(cls._context_locals, "current_instance", None)
+        if panel is not None:
+            panel.events.append(
+                {
+                    "phase": phase,
+                    "menu_names": ", ".join(menu_names),
+                    "duration": duration * 1000,
+                    "info": info,
+                }
+            )
+
+    @property
+    def nav_subtitle(self) -> str:
+        stats: dict = self.get_stats()
+        if not stats:
+            return ""
+        return f"{stats['total_time']:.2f} ms, queries: {stats['queries']}"
+
+    def enable_instrumentation(self):
+        self._context_locals.current_instance = self
+
+    def disable_instrumentation(self):
+        self._context_locals.current_instance = None
+
+    def generate_stats(self, request, response):
+        phase_times: dict = defaultdict(float)
+        for event in self.events:
+            phase_times[event["phase"]] += event["duration"]
+        self.record_stats(
+            {
+                "events": self.events,
+                "phase_times": dict(phase_times),
+                # load phase includes query and build
+                "total_time": phase_times["load"]
+                + phase_times["url_resolve"]
+                + phase_times["render"],
+                "queries": sum(
+                    event["info"].get("queries", 0) for event in self.events
+                ),
+            }
+        )
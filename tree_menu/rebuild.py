@@ -0,0 +1,74 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Iterable, Optional
+
+from asgiref.local import Local
+from django.apps import apps
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# ids of changed menus of current thread or async task while rebuilds are deferred
+_deferred = Local()
+# one worker, so background rebuilds of a menu never run concurrently
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_deferred_menus() -> Optional[set]:
+    """Return set for ids of menus to rebuild, None when rebuilds are not deferred."""
+    return getattr(_deferred, "menu_ids", None)
+
+
+def rebuild_menus(menu_ids: Iterable[int]) -> None:
+    """Rebuild tree fields of existing menus, cache of every menu is invalidated once."""
+    menu_model = apps.get_model("tree_menu", "TreeMenu")
+    item_model = apps.get_model("tree_menu", "TreeMenuItem")
+    for menu_id in menu_model.objects.filter(pk__in=menu_ids).values_list(
+        "pk", flat=True
+    ):
+        item_model.rebuild_menu(menu_id)
+
+
+def _rebuild_in_background(menu_ids: set) -> None:
+    try:
+        rebuild_menus(menu_ids)
+    except Exception:
+        logger.exception("Background rebuild of menus %s failed", sorted(menu_ids))
+    finally:
+        close_old_connections()
+
+
+def _submit_rebuild(menu_ids: set) -> None:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="tree_menu_rebuild"
+        )
+    _executor.submit(_rebuild_in_background, menu_ids)
+
+
+@contextmanager
+def deferred_rebuild(background: bool = False):
+    """Save and delete items without tree maintenance, then rebuild every changed menu once.
+
+    Tree fields of changed menus are outdated inside the block. Rebuild runs at exit
+    of the outermost block, with background it runs by worker thread after commit.
+    """
+    if get_deferred_menus() is not None:
+        # nested block, the outermost one rebuilds menus
+        yield
+        return
+    menu_ids: set = set()
+    _deferred.menu_ids = menu_ids
+    try:
+        yield
+    finally:
+        _deferred.menu_ids = None
+    if not menu_ids:
+        return
+    if background:
+        transaction.on_commit(partial(_submit_rebuild, menu_ids))
+    else:
+        rebuild_menus(menu_ids)
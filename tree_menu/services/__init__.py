@@ -1,3 +1,13 @@
+from .menu_transfer import export_menu, import_menu, menu_outline, restructure_menu
+from .nested_set import NestedSetIndex
 from .tree_menu import AdminModelsItemMenuChoices, TreeMenu
 
-__all__ = (AdminModelsItemMenuChoices, TreeMenu)
+__all__ = (
+    AdminModelsItemMenuChoices,
+    NestedSetIndex,
+    TreeMenu,
+    export_menu,
+    import_menu,
+    menu_outline,
+    restructure_menu,
+)
@@ -0,0 +1,399 @@
+import asyncio
+import random
+import statistics
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.template import Context, Template
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import exceptions, resolve, reverse
+
+from ..cache import fragment_cache, invalidate_menu, local_cache
+from ..models import TreeMenu as TreeMenuModel
+from ..models import TreeMenuItem
+from .menu_transfer import import_menu
+from .tree_menu import AdminModelsItemMenuChoices, TreeMenu
+
+SHAPES = ("deep", "wide", "balanced")
+
+
+class BaselineTreeMenu:
+    """Renderer of the first version of app, it is kept to check output and speed of TreeMenu.
+
+    Every item url is reversed, tree is prepared with is_child check for every node
+    and html is built by recursive string concatenation.
+    """
+
+    menu_item_html = '<li><span class="{current}"><a href="{url}">{name}</a></span>'
+    list_menu_items_html = "<ul {ul_class}>{menu_items}</ul>"
+    css_class_html = 'class="wtree"'
+
+    def __init__(self, menu_name, request):
+        self.menu_name = menu_name
+        try:
+            url_name: Optional[str] = resolve(request.path_info).url_name
+        except exceptions.Resolver404:
+            url_name = None
+        self.current_url = [request.path_info, request.build_absolute_uri(), url_name]
+        self.family, self.head, self.current = self._query_to_family()
+
+    @staticmethod
+    def _to_url(url: str) -> str:
+        try:
+            return reverse(url)
+        except exceptions.NoReverseMatch:
+            return url
+
+    @staticmethod
+    def is_child(parent_obj, child_obj) -> bool:
+        if parent_obj is None or child_obj is None:
+            return False
+        return (
+            parent_obj.left_value < child_obj.left_value
+            and parent_obj.right_value > child_obj.right_value
+            and parent_obj.menu_id == child_obj.menu_id
+        )
+
+    def _query_to_family(self) -> tuple:
+        family: dict = {}
+        head_item: Optional[int] = None
+        current_item: Optional[TreeMenuItem] = None
+        for obj in TreeMenuItem.objects.filter(menu__name=self.menu_name).order_by(
+            "menu_id", "left_value"
+        ):
+            family.setdefault(obj.pk, {"children": []}).update(
+                {"name": obj.name, "obj": obj, "url": self._to_url(obj.url)}
+            )
+            if obj.parent_id is None:
+                head_item = obj.pk
+            family.setdefault(obj.parent_id, {"children": []})["children"].append(
+                obj.pk
+            )
+            if obj.url is not None and obj.url in self.current_url:
+                current_item = obj
+        return family, head_item, current_item
+
+    def tree_for_render(self) -> Optional[list]:
+        if self.head is None:
+            return None
+        return self._get_children(self.head)
+
+    def _get_children(self, menu_item_id) -> List[dict]:
+        result: list = []
+        for child_id in self.family[menu_item_id]["children"]:
+            child: dict = self.family[child_id]
+            item_menu: dict = {
+                "name": child["name"],
+                "url": child["url"],
+                "current": "current" if self.current == child["obj"] else "",
+            }
+            if (
+                self.is_child(child["obj"], self.current)
+                or self.current == child["obj"]
+            ) and len(child["children"]) > 0:
+                item_menu["children"] = self._get_children(child_id)
+            result.append(item_menu)
+        return result
+
+    def _render_by_tree(self, for_render_tree: list, first: bool = True) -> str:
+        list_menu_items: str = ""
+        for item_menu in for_render_tree:
+            list_menu_items += self.menu_item_html.format(**item_menu)
+            children: Optional[list] = item_menu.get("children")
+            if children is not None:
+                list_menu_items += self._render_by_tree(children, first=False)
+        return self.list_menu_items_html.format(
+            menu_items=list_menu_items, ul_class=self.css_class_html if first else ""
+        )
+
+    def render_menu(self) -> str:
+        if self.head is None:
+            return f"Tree menu &lt;{self.menu_name}&gt; not fount"
+        return self._render_by_tree(self.tree_for_render())
+
+
+def generate_menu_items(
+    shape: str,
+    size: int,
+    depth: int = 10,
+    fanout: int = 5,
+    seed: int = 0,
+    max_level: Optional[int] = None,
+) -> List[dict]:
+    """Generate items of menu for import_menu, same seed gives same menu.
+
+    deep: one chain of size items, wide: size items of one level,
+    balanced: every item has fanout children up to depth levels or size items.
+    max_level: limit of levels of storage, items of deep chain below it are
+    siblings on the last level. The last generated item is the deepest one.
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown menu shape: {shape}")
+    rnd = random.Random(seed)
+    # random names, so items are not inserted in name order
+    numbers: list = rnd.sample(range(size * 10), size)
+
+    def make_item(index: int) -> dict:
+        return {
+            "name": f"Item {numbers[index]:07d}",
+            "url": f"/bench/{shape}/{index}",
+            "children": [],
+        }
+
+    items: list = []
+    if shape == "wide":
+        items = [make_item(index) for index in range(size)]
+    elif shape == "deep":
+        siblings: list = items
+        for index in range(size):
+            siblings.append(make_item(index))
+            if max_level is None or index + 1 < max_level:
+                siblings = siblings[-1]["children"]
+    else:
+        # breadth first fill, queue of (children list, level)
+        queue: list = [(items, 1)]
+        index = 0
+        while index < size and queue:
+            siblings, level = queue.pop(0)
+            for _ in range(fanout):
+                if index >= size:
+                    break
+                siblings.append(make_item(index))
+                if level < depth:
+                    queue.append((siblings[-1]["children"], level + 1))
+                index += 1
+    return items
+
+
+def measure(func: Callable, repeat: int, setup: Optional[Callable] = None) -> dict:
+    """Return milliseconds and count of queries of func calls."""
+    times: list = []
+    queries: list = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as context:
+            start: float = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context))
+    return {
+        "min_ms": round(min(times), 4),
+        "median_ms": round(statistics.median(times), 4),
+        "mean_ms": round(statistics.mean(times), 4),
+        "queries": max(queries),
+    }
+
+
+def _reset_local_caches(menu_name: str):
+    invalidate_menu(menu_name)
+    local_cache.clear()
+    fragment_cache.clear()
+
+
+def bench_menu(
+    shape: str, size: int, depth: int, fanout: int, seed: int, repeat: int
+) -> dict:
+    """Create menu of given shape, measure menu operations and delete the menu."""
+    menu_name = f"bench {shape} {size}"
+    items: list = generate_menu_items(
+        shape, size, depth, fanout, seed, TreeMenuItem.get_storage().max_level
+    )
+    results: dict = {}
+
+    start: float = time.perf_counter()
+    menu: TreeMenuModel = import_menu(menu_name, items, replace=True)
+    results["import"] = {"ms": round((time.perf_counter() - start) * 1000, 4)}
+    try:
+        leaf: TreeMenuItem = TreeMenuItem.objects.get(
+            menu=menu, url=f"/bench/{shape}/{size - 1}"
+        )
+        factory = RequestFactory()
+
+        def render():
+            TreeMenu(menu_name, factory.get(leaf.url)).render_menu()
+
+        results["render_cold"] = measure(
+            render, repeat, setup=lambda: _reset_local_caches(menu_name)
+        )
+        render()
+        results["render_warm"] = measure(render, repeat)
+        results.update(bench_render_phases(menu_name, factory.get(leaf.url), repeat))
+        results["rebuild_menu"] = measure(
+            lambda: TreeMenuItem.rebuild_menu(menu.pk), repeat
+        )
+        results["admin_choices"] = measure(
+            lambda: AdminModelsItemMenuChoices(leaf).choices(), repeat
+        )
+
+        parent: TreeMenuItem = leaf.parent
+        created: list = []
+
+        def insert():
+            item = TreeMenuItem(
+                name=f"New {len(created)}",
+                url=f"/bench/new/{len(created)}",
+                menu=menu,
+                parent=parent,
+            )
+            item.save()
+            created.append(item)
+
+        results["save_insert"] = measure(insert, repeat)
+
+        def update():
+            leaf.url = f"/bench/{shape}/{size - 1}"
+            leaf.save()
+
+        results["save_update"] = measure(update, repeat)
+
+        # move the leaf between its parent and other top level item
+        other: TreeMenuItem = (
+            TreeMenuItem.objects.filter(menu=menu, level=1)
+            .exclude(pk__in=[leaf.pk, parent.pk])
+            .first()
+        )
+        targets: list = [other, parent]
+
+        def move():
+            leaf.parent = targets[0]
+            leaf.save()
+            targets.reverse()
+
+        if other is not None:
+            results["save_move"] = measure(move, repeat)
+        results["delete"] = measure(lambda: created.pop().delete(), repeat)
+    finally:
+        menu.delete()
+    return results
+
+
+def bench_render_phases(menu_name: str, request, repeat: int) -> dict:
+    """Compare TreeMenu with BaselineTreeMenu by phases of render for one page.
+
+    render_baseline: full render of the first version of app.
+    expand: finding of expanded items, render_html: html of loaded menu without cache.
+    render_direct and draw_menu_tag: cached menu rendered by TreeMenu and by template
+    with draw_menu tag, the difference is overhead of template tag.
+    Phases of baseline are skipped when its recursion is too deep for the menu.
+    """
+    results: dict = {}
+    menu = TreeMenu(menu_name, request)
+    version, structure = TreeMenu.load_menus(None, [menu_name])[menu_name]
+    current: Optional[int] = structure.find_item(menu.current_url)
+    results["expand"] = measure(lambda: structure.ancestors(current), repeat)
+    results["render_html"] = measure(menu._render_html, repeat)
+    try:
+        results["render_baseline"] = measure(
+            lambda: BaselineTreeMenu(menu_name, request).render_menu(), repeat
+        )
+        baseline = BaselineTreeMenu(menu_name, request)
+        results["expand_baseline"] = measure(baseline.tree_for_render, repeat)
+        results["render_html_baseline"] = measure(baseline.render_menu, repeat)
+    except RecursionError:
+        pass
+
+    template = Template("{% load tree_menu_tags %}{% draw_menu menu_name %}")
+    context = Context({"menu_name": menu_name})
+    # draw_menu takes request as RequestContext has it, without context processors
+    context.request = request
+    template.render(context)
+    results["render_direct"] = measure(
+        lambda: TreeMenu(menu_name, request).render_menu(), repeat
+    )
+    results["draw_menu_tag"] = measure(lambda: template.render(context), repeat)
+    return results
+
+
+async def _run_concurrently(
+    render: Callable[..., Awaitable], requests: list, concurrency: int
+) -> float:
+    """Render page for every request with up to concurrency requests at once, return seconds."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def serve(request):
+        async with semaphore:
+            await render(request)
+
+    start: float = time.perf_counter()
+    await asyncio.gather(*(serve(request) for request in requests))
+    return time.perf_counter() - start
+
+
+def bench_load(
+    shapes: List[str],
+    size: int,
+    depth: int,
+    fanout: int,
+    seed: int,
+    requests: int,
+    concurrency: int,
+) -> dict:
+    """Measure requests per second of pages with all menus of shapes under concurrent load.
+
+    sync: menus are rendered by sync code in thread as ASGI handler runs sync views,
+    async: TreeMenu.arender_many loads menus by async cache and ORM.
+    warm: menus are in process memory, cold: without process memory every request
+    reads menus from shared cache, db: without cache every request loads menus from database.
+    """
+    menu_names: list = [f"bench {shape} {size}" for shape in shapes]
+    menus: list = [
+        import_menu(
+            menu_name,
+            generate_menu_items(
+                shape, size, depth, fanout, seed, TreeMenuItem.get_storage().max_level
+            ),
+            replace=True,
+        )
+        for shape, menu_name in zip(shapes, menu_names)
+    ]
+    try:
+        pages: list = list(
+            TreeMenuItem.objects.filter(menu__in=menus)
+            .order_by("?")
+            .values_list("url", flat=True)[:requests]
+        )
+        factory = RequestFactory()
+
+        def render_sync(request) -> list:
+            TreeMenu.load_menus(request, menu_names)
+            return [TreeMenu(name, request).render_menu() for name in menu_names]
+
+        modes: dict = {
+            "sync": sync_to_async(render_sync),
+            "async": lambda request: TreeMenu.arender_many(menu_names, request),
+        }
+        states: dict = {
+            "warm": {},
+            "cold": {
+                "TREE_MENU_LOCAL_CACHE_SIZE": 0,
+                "TREE_MENU_FRAGMENT_CACHE_SIZE": 0,
+            },
+            "db": {"TREE_MENU_CACHE_ALIAS": None},
+        }
+        results: dict = {}
+        for mode, render in modes.items():
+            for state, state_settings in states.items():
+                with override_settings(**state_settings):
+                    render_sync(factory.get(pages[0]))
+                    seconds: float = asyncio.run(
+                        _run_concurrently(
+                            render,
+                            [
+                                factory.get(pages[i % len(pages)])
+                                for i in range(requests)
+                            ],
+                            concurrency,
+                        )
+                    )
+                results[f"{mode}_{state}"] = {
+                    "ms": round(seconds * 1000 / requests, 4),
+                    "rps": round(requests / seconds, 1),
+                }
+    finally:
+        for menu in menus:
+            menu.delete()
+    return results
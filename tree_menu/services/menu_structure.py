@@ -0,0 +1,238 @@
+import hashlib
+import zlib
+from typing import Callable, Iterable, List, Optional
+
+from django.utils.safestring import SafeString, mark_safe
+
+from .url_resolver import normalize_url, resolve_menu_url, url_segments
+
+
+class UrlMatcher:
+    """Search of menu item position by urls of page."""
+
+    __slots__ = ("url_index", "url_tree")
+
+    def find_item(
+        self, urls: Iterable[Optional[str]], prefix: bool = False
+    ) -> Optional[int]:
+        """Return position of item by any of urls, the last item in menu order wins.
+
+        Query strings and trailing slashes are ignored. With prefix path urls
+        without exact match find item with the longest url prefix by whole segments.
+        """
+        urls = [url for url in urls if url is not None]
+        positions: list = [
+            self.url_index[url]
+            for url in (*urls, *map(normalize_url, urls))
+            if url in self.url_index
+        ]
+        if positions:
+            return max(positions)
+        if prefix:
+            positions = [
+                self.find_prefix(normalize_url(url)) for url in urls if url[:1] == "/"
+            ]
+            positions = [position for position in positions if position is not None]
+            if positions:
+                return max(positions)
+        return None
+
+    def find_prefix(self, path: str) -> Optional[int]:
+        """Return position of item with the longest url prefix of path.
+
+        Time depends on count of path segments only, root url is not a prefix.
+        """
+        node: Optional[dict] = self.url_tree
+        position: Optional[int] = None
+        for segment in url_segments(path):
+            node = node.get(segment)
+            if node is None:
+                break
+            position = node.get(None, position)
+        return position
+
+
+class MenuStructure(UrlMatcher):
+    """Compact tree of menu`s items.
+
+    Items are addressed by position in nested set order and their data is kept
+    in parallel tuples, so the structure is small in memory and cheap to pickle.
+    """
+
+    __slots__ = (
+        "ids",
+        "names",
+        "urls",
+        "parents",
+        "children",
+        "html",
+        "head",
+        "child_counts",
+    )
+
+    def __init__(
+        self,
+        ids: tuple,
+        names: tuple,
+        urls: tuple,
+        parents: tuple,
+        children: tuple,
+        html: tuple,
+        url_index: dict,
+        url_tree: dict,
+        head: Optional[int],
+        child_counts: Optional[tuple] = None,
+    ):
+        self.ids = ids
+        self.names = names
+        # resolved urls
+        self.urls = urls
+        # position of parent, -1 for item without parent in menu
+        self.parents = parents
+        # tuples with positions of children
+        self.children = children
+        # static html parts of items, they are joined by current css class
+        self.html = html
+        # position of item by stored and normalized resolved url
+        self.url_index = url_index
+        # tree of path segments of items urls, position of item is under None key
+        self.url_tree = url_tree
+        # position of menu`s head item
+        self.head = head
+        # counts of children in database for part of menu, None for whole menu
+        self.child_counts = child_counts
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def child_count(self, position: int) -> int:
+        """Return count of item`s children, some of them are not loaded in part of menu."""
+        if self.child_counts is None:
+            return len(self.children[position])
+        return self.child_counts[position]
+
+    def content_key(self, *markup: str) -> str:
+        """Return hash of everything rendered html depends on, markup is html templates."""
+        content: tuple = (
+            markup,
+            self.ids,
+            self.parents,
+            self.children,
+            self.html,
+            self.head,
+            self.url_index,
+        )
+        return hashlib.md5(repr(content).encode()).hexdigest()
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: Iterable[tuple],
+        compile_item_html: Callable[[str, str], tuple],
+        with_counts: bool = False,
+    ) -> "MenuStructure":
+        """Build structure from rows of (id, parent_id, name, url) ordered by left value.
+
+        with_counts: rows are part of menu, the fifth column is count of item`s children.
+        """
+        ids: list = []
+        names: list = []
+        urls: list = []
+        parent_ids: list = []
+        html: list = []
+        url_index: dict = {}
+        url_tree: dict = {}
+        counts: list = []
+        for pk, parent_id, name, url, *other in rows:
+            position: int = len(ids)
+            if with_counts:
+                counts.append(other[0])
+            resolved_url: str = resolve_menu_url(url)
+            ids.append(pk)
+            names.append(name)
+            urls.append(resolved_url)
+            parent_ids.append(parent_id)
+            html.append(compile_item_html(name, resolved_url))
+            if url is not None:
+                normalized_url: str = normalize_url(resolved_url)
+                url_index[url] = position
+                url_index[normalized_url] = position
+                if normalized_url.startswith("/"):
+                    node: dict = url_tree
+                    for segment in url_segments(normalized_url):
+                        node = node.setdefault(segment, {})
+                    node[None] = position
+
+        positions: dict = {pk: position for position, pk in enumerate(ids)}
+        parents: list = [positions.get(parent_id, -1) for parent_id in parent_ids]
+        children: List[list] = [[] for _ in ids]
+        head: Optional[int] = None
+        for position, parent_id in enumerate(parent_ids):
+            if parent_id is None:
+                head = position
+            elif parents[position] >= 0:
+                children[parents[position]].append(position)
+
+        return cls(
+            tuple(ids),
+            tuple(names),
+            tuple(urls),
+            tuple(parents),
+            tuple(tuple(item_children) for item_children in children),
+            tuple(html),
+            url_index,
+            url_tree,
+            head,
+            tuple(counts) if with_counts else None,
+        )
+
+    def ancestors(self, position: Optional[int]) -> set:
+        """Return positions of item and all its ancestors."""
+        result: set = set()
+        while position is not None and position >= 0:
+            result.add(position)
+            position = self.parents[position]
+        return result
+
+
+class PrerenderedMenu(UrlMatcher):
+    """Html of menu for every current item, it is served without menu structure.
+
+    Html is compressed, so all variants of big menu are cheap to keep in memory.
+    """
+
+    __slots__ = ("html", "content_key")
+
+    def __init__(self, url_index: dict, url_tree: dict, html: dict, content_key: str):
+        self.url_index = url_index
+        self.url_tree = url_tree
+        # compressed html by position of current item, None is for pages out of menu
+        self.html = html
+        # content key of menu structure, prerendered menu is valid while it is the same
+        self.content_key = content_key
+
+    def __len__(self) -> int:
+        return len(self.html)
+
+    @classmethod
+    def from_variants(
+        cls, structure: MenuStructure, variants: dict, content_key: str
+    ) -> "PrerenderedMenu":
+        """Build from html by current item id, as render_variants returns it."""
+        positions: dict = {pk: position for position, pk in enumerate(structure.ids)}
+        return cls(
+            structure.url_index,
+            structure.url_tree,
+            {
+                positions.get(item_id): zlib.compress(html.encode())
+                for item_id, html in variants.items()
+            },
+            content_key,
+        )
+
+    def find_html(
+        self, urls: Iterable[Optional[str]], prefix: bool = False
+    ) -> Optional[SafeString]:
+        """Return html of menu for page urls, None if html of current item is missing."""
+        html: Optional[bytes] = self.html.get(self.find_item(urls, prefix))
+        return None if html is None else mark_safe(zlib.decompress(html).decode())
@@ -0,0 +1,197 @@
+import json
+from typing import Iterator, List, Optional
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from ..models import TreeMenu, TreeMenuItem, item_menu_url_validator
+
+
+def _sorted_children(children) -> list:
+    """Check data of items and return them ordered by name."""
+    if not isinstance(children, list):
+        raise ValueError("Children of item must be a list.")
+    name_length: int = TreeMenuItem._meta.get_field("name").max_length
+    url_length: int = TreeMenuItem._meta.get_field("url").max_length
+    for data in children:
+        if not isinstance(data, dict):
+            raise ValueError("Item must be an object with name and url.")
+        for key, max_length in (("name", name_length), ("url", url_length)):
+            if not isinstance(data.get(key), str) or not data[key]:
+                raise ValueError(f"Item {key} is required: {data!r:.100}.")
+            if len(data[key]) > max_length:
+                raise ValueError(
+                    f"Item {key} is longer than {max_length} characters: {data[key]!r}."
+                )
+    return sorted(children, key=lambda i: i["name"])
+
+
+def _build_levels(menu: TreeMenu, root_item: TreeMenuItem, items: List[dict]) -> list:
+    """Create unsaved menu items with nested set values.
+
+    Return lists of (item, parent item) grouped by level, children are ordered by name.
+    Raise ValueError for invalid data of items.
+    """
+    levels: list = []
+    urls: set = set()
+    value = 1
+    # stack of (item, iterator over item`s children data)
+    stack: list = [(root_item, iter(_sorted_children(items)))]
+    while stack:
+        parent, children = stack[-1]
+        data: Optional[dict] = next(children, None)
+        value += 1
+        if data is None:
+            stack.pop()
+            parent.right_value = value
+            continue
+
+        if data["url"] in urls:
+            raise ValueError(f"Item url is not unique in menu: {data['url']!r}.")
+        urls.add(data["url"])
+        try:
+            item_menu_url_validator(data["url"])
+        except ValidationError:
+            raise ValueError(f"Item url is not valid: {data['url']!r}.") from None
+        item = TreeMenuItem(
+            name=data["name"],
+            url=data["url"],
+            menu_id=menu.pk,
+            left_value=value,
+            level=len(stack),
+        )
+        if len(levels) < len(stack):
+            levels.append([])
+        levels[len(stack) - 1].append((item, parent))
+        stack.append((item, iter(_sorted_children(data.get("children") or []))))
+    return levels
+
+
+@transaction.atomic
+def import_menu(menu_name: str, items: List[dict], replace: bool = False) -> TreeMenu:
+    """Create menu from nested items by one insert query for every level.
+
+    items: list of dicts with name, url and list of same dicts in children.
+    """
+    if len(menu_name) > TreeMenu._meta.get_field("name").max_length:
+        raise ValueError(f"Tree menu name is too long: {menu_name!r}.")
+    menu: Optional[TreeMenu] = TreeMenu.objects.filter(name=menu_name).first()
+    if menu is not None:
+        if not replace:
+            raise ValueError(f"Tree menu <{menu_name}> already exists.")
+        menu.delete()
+    menu = TreeMenu.objects.create(name=menu_name)
+    root_item: TreeMenuItem = TreeMenuItem.objects.get(menu=menu, parent__isnull=True)
+
+    for level_items in _build_levels(menu, root_item, items):
+        for item, parent in level_items:
+            item.parent_id = parent.pk
+        created: list = TreeMenuItem.objects.bulk_create(
+            [item for item, parent in level_items]
+        )
+        if created and created[0].pk is None:
+            # database can not return ids of inserted rows
+            ids: dict = dict(
+                TreeMenuItem.objects.filter(
+                    menu=menu, level=created[0].level
+                ).values_list("left_value", "id")
+            )
+            for item in created:
+                item.pk = ids[item.left_value]
+
+    TreeMenuItem.objects.filter(pk=root_item.pk).update(
+        right_value=root_item.right_value
+    )
+    TreeMenuItem.get_storage().imported(menu.pk)
+    TreeMenu.invalidate_cache(menu.pk)
+    return menu
+
+
+def export_menu(menu_name: str) -> Iterator[str]:
+    """Stream menu as json with nested items, the format is accepted by import_menu."""
+    items = (
+        TreeMenuItem.objects.filter(menu__name=menu_name, parent__isnull=False)
+        .order_by(*TreeMenuItem.get_storage().order_fields)
+        .values_list("name", "url", "level")
+    )
+    yield f'{{"name": {json.dumps(menu_name)}, "items": ['
+    previous_level: int = 0
+    for name, url, level in items.iterator(chunk_size=2000):
+        if level <= previous_level:
+            # close previous item and its parents up to sibling of current item
+            yield "]}" * (previous_level - level + 1) + ", "
+        yield f'{{"name": {json.dumps(name)}, "url": {json.dumps(url)}, "children": ['
+        previous_level = level
+    yield "]}" * previous_level + "]}\n"
+
+
+def menu_outline(menu_id: int) -> List[dict]:
+    """Return nested items of menu with ids, the format is accepted by restructure_menu."""
+    items = (
+        TreeMenuItem.objects.filter(menu_id=menu_id, parent__isnull=False)
+        .order_by(*TreeMenuItem.get_storage().order_fields)
+        .values_list("id", "name", "level")
+    )
+    outline: list = []
+    # children lists by level of their items
+    levels: list = [outline]
+    for pk, name, level in items:
+        del levels[level:]
+        levels[-1].append({"id": pk, "name": name, "children": []})
+        levels.append(levels[-1][-1]["children"])
+    return outline
+
+
+@transaction.atomic
+def restructure_menu(menu_id: int, items: List[dict]) -> int:
+    """Set parents of all menu`s items from nested items by one rebuild of menu.
+
+    items: list of dicts with id and list of same dicts in children, every item
+    of menu except root is listed once. Children are ordered by name anyway.
+    Return count of moved items.
+    """
+    storage = TreeMenuItem.get_storage()
+    TreeMenu.lock_menus(menu_id)
+    parents: dict = dict(
+        TreeMenuItem.objects.select_for_update()
+        .filter(menu_id=menu_id)
+        .values_list("id", "parent_id")
+    )
+    root_id: Optional[int] = next(
+        (pk for pk, parent_id in parents.items() if parent_id is None), None
+    )
+    if root_id is None:
+        raise ValueError(f"Tree menu with id {menu_id} does not exist.")
+
+    new_parents: dict = {}
+    # stack of (parent id, list of children data)
+    stack: list = [(root_id, items)]
+    while stack:
+        parent_id, children = stack.pop()
+        if not isinstance(children, list):
+            raise ValueError("Children of item have to be a list.")
+        for data in children:
+            if not isinstance(data, dict):
+                raise ValueError("Item has to be an object with id and children.")
+            pk = data.get("id")
+            if not isinstance(pk, int) or isinstance(pk, bool):
+                raise ValueError(f"Item id has to be an integer: {pk!r:.100}.")
+            if pk not in parents or pk == root_id:
+                raise ValueError(f"Item {pk} is not an item of menu {menu_id}.")
+            if pk in new_parents:
+                raise ValueError(f"Item {pk} is listed more than once.")
+            new_parents[pk] = parent_id
+            stack.append((pk, data.get("children", [])))
+    if len(new_parents) != len(parents) - 1:
+        raise ValueError("All items of menu have to be listed.")
+
+    moved: list = [
+        TreeMenuItem(pk=pk, parent_id=parent_id)
+        for pk, parent_id in new_parents.items()
+        if parents[pk] != parent_id
+    ]
+    if moved:
+        TreeMenuItem.objects.bulk_update(moved, ["parent"])
+        storage.rebuild(menu_id)
+        TreeMenu.invalidate_cache(menu_id)
+    return len(moved)
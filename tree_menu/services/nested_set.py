@@ -0,0 +1,64 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterable, List, Optional
+
+
+class NestedSetIndex:
+    """Index of menu`s items by nested set values.
+
+    Items are sorted by (menu id, left value), so a subtree is a continuous
+    range found by bisect in O(log n + k) without recursion.
+    """
+
+    def __init__(self, rows: Iterable[tuple]):
+        """rows: (id, parent_id, menu_id, left_value, right_value, level)."""
+        self.items: dict = {}
+        self.children: dict = {}
+        keys: list = []
+        ids: list = []
+        for pk, parent_id, menu_id, left_value, right_value, level in sorted(
+            rows, key=lambda row: (row[2], row[3])
+        ):
+            self.items[pk] = (parent_id, menu_id, left_value, right_value, level)
+            self.children.setdefault((menu_id, parent_id), []).append(pk)
+            keys.append((menu_id, left_value))
+            ids.append(pk)
+        self.keys: List[tuple] = keys
+        self.ids: List[int] = ids
+
+    def descendants(self, item_id: int) -> List[int]:
+        """Return ids of all descendants of item in menu order."""
+        parent_id, menu_id, left_value, right_value, level = self.items[item_id]
+        start: int = bisect_right(self.keys, (menu_id, left_value))
+        end: int = bisect_left(self.keys, (menu_id, right_value), lo=start)
+        return self.ids[start:end]
+
+    def ancestors(self, item_id: int) -> List[int]:
+        """Return ids of ancestors of item from head of menu."""
+        result: list = []
+        parent_id: Optional[int] = self.items[item_id][0]
+        while parent_id is not None and parent_id in self.items:
+            result.append(parent_id)
+            parent_id = self.items[parent_id][0]
+        result.reverse()
+        return result
+
+    def siblings(self, item_id: int) -> List[int]:
+        """Return ids of other children of item`s parent in the same menu."""
+        parent_id, menu_id, *_ = self.items[item_id]
+        return [
+            pk for pk in self.children.get((menu_id, parent_id), []) if pk != item_id
+        ]
+
+    def depth(self, item_id: int) -> int:
+        """Return level of item, head of menu has level 0."""
+        return self.items[item_id][4]
+
+    def is_descendant(self, item_id: int, ancestor_id: int) -> bool:
+        """Checks the relationship of items by nested set values."""
+        _, menu_id, left_value, right_value, _ = self.items[item_id]
+        _, ancestor_menu_id, ancestor_left, ancestor_right, _ = self.items[ancestor_id]
+        return (
+            menu_id == ancestor_menu_id
+            and ancestor_left < left_value
+            and right_value < ancestor_right
+        )
@@ -1,25 +1,306 @@
-from typing import List, Optional
+import hashlib
+import logging
+from functools import cached_property
+from typing import Iterable, List, Optional
 
-from django.urls import exceptions, resolve, reverse
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.urls import Resolver404, resolve
+from django.utils.html import escape
+from django.utils.safestring import SafeString, mark_safe
 
+from ..cache import (
+    aget_menu_structures,
+    get_cache,
+    get_menu_fragment,
+    get_menu_structures,
+    get_menu_versions,
+    get_prerendered_menu,
+    set_menu_fragment,
+    set_shared_menu_fragments,
+)
+from ..conf import menu_settings
+from ..metrics import PhaseTimer
 from ..models import TreeMenuItem
+from .menu_structure import MenuStructure, PrerenderedMenu
+from .nested_set import NestedSetIndex
+from .url_resolver import normalize_url, resolve_menu_url, url_segments
+
+logger = logging.getLogger(__name__)
 
 
 class TreeMenu:
     menu_item_html = '<li><span class="{current}"><a href="{url}">{name}</a></span>'
     list_menu_items_html = "<ul {ul_class}>{menu_items}</ul>"
     css_class_html = 'class="wtree"'
+    # placeholder for items which are not rendered, they are loaded by menu_children view
+    more_items_html = (
+        '<li class="more" data-parent="{parent}" data-offset="{offset}"></li>'
+    )
+
+    # request attributes for data shared by all menus of one request
+    request_menus_attr = "_tree_menu_structures"
+    request_current_url_attr = "_tree_menu_current_url"
 
-    def __init__(self, menu_name, request):
+    def __init__(
+        self,
+        menu_name,
+        request=None,
+        menus: Optional[dict] = None,
+        max_depth: Optional[int] = None,
+        max_siblings: Optional[int] = None,
+    ):
+        """Menu for request, without request menu has no current item.
+
+        menus: already loaded versions and structures of menus by name.
+        max_depth: levels of menu to render, top items have level 1.
+        max_siblings: children to render in every list, expanded child is always rendered.
+        With options menu not loaded for request is loaded by visible items only.
+        """
         self.menu_name = menu_name
         self.request = request
-        self.current_url = [
-            self._get_url(),
-            self._get_absolute_url(),
-            self._get_url_name(),
-        ]
-        self.current_url_name = self._get_url_name()
-        self.__family, self.__head, self.__current = self._query_to_family()
+        self.max_depth = max_depth
+        self.max_siblings = max_siblings
+        # render options are part of key of cached html
+        self.options: tuple = (
+            ()
+            if max_depth is None and max_siblings is None
+            else (max_depth, max_siblings)
+        )
+        self.current_url = self._get_current_url()
+        self.current_url_name = self.current_url[2] if self.current_url else None
+        # menu of prerender_menus command, structure is not loaded while it is used
+        self.__prerendered: Optional[PrerenderedMenu] = None
+        self.__structure: Optional[MenuStructure] = None
+        if (
+            menu_settings.PRERENDERED
+            and not self.options
+            and (menus is None or menu_name not in menus)
+        ):
+            with PhaseTimer("load", [menu_name]) as timer:
+                self.__prerendered = get_prerendered_menu(
+                    menu_name, self._structure_content_key
+                )
+                timer.info["cache"] = {
+                    menu_name: "prerendered" if self.__prerendered else "missing"
+                }
+        if self.__prerendered is not None or self.__structure is not None:
+            return
+        if self.options and menu_name not in (
+            menus or self._get_request_menus(request)
+        ):
+            # visible part of menu is loaded by render_menu if html is not cached
+            self.version: Optional[str] = get_menu_versions([menu_name]).get(menu_name)
+            self.__current = None
+        else:
+            self.__load_structure(menus)
+
+    def __load_structure(self, menus: Optional[dict] = None):
+        if menus is None or self.menu_name not in menus:
+            menus = self.load_menus(self.request, [self.menu_name])
+        self.__prerendered = None
+        self.version, self.__structure = menus[self.menu_name]
+        # position of current item in menu structure
+        self.__current = self.__structure.find_item(
+            self.current_url, prefix=menu_settings.URL_PREFIX_MATCH
+        )
+
+    def __load_visible_structure(self):
+        """Load items of menu visible with render options and find current item.
+
+        Visible items are head, ancestors of current item found by range of tree
+        values and their children up to max_depth level, max_siblings of every list.
+        """
+        with PhaseTimer("load", [self.menu_name]) as timer:
+            with PhaseTimer("query", [self.menu_name], count_queries=True):
+                current_item: Optional[TreeMenuItem] = self._find_current_item()
+                rows: list = list(self._get_visible_queryset(current_item))
+            with PhaseTimer("build", [self.menu_name]):
+                structure = MenuStructure.from_rows(
+                    rows, self._compile_item_html, with_counts=True
+                )
+            timer.info["cache"] = {self.menu_name: "visible"}
+        self.__structure = structure
+        self.__current = (
+            None if current_item is None else structure.ids.index(current_item.pk)
+        )
+
+    def _current_url_candidates(self) -> set:
+        """Return stored urls of items which can match page, as find_item matches them.
+
+        Named urls of items are found by names of page paths.
+        """
+        candidates: set = set()
+        for url in self.current_url:
+            if url is None:
+                continue
+            normalized_url: str = normalize_url(url)
+            candidates.update((url, normalized_url, normalized_url.rstrip("/") + "/"))
+            if menu_settings.URL_PREFIX_MATCH and url[:1] == "/":
+                prefix: str = ""
+                for segment in url_segments(normalized_url):
+                    prefix += "/" + segment
+                    candidates.update((prefix, prefix + "/"))
+        for url in [url for url in candidates if url[:1] == "/"]:
+            try:
+                match = resolve(url)
+            except Resolver404:
+                continue
+            candidates.update(
+                name for name in (match.url_name, match.view_name) if name
+            )
+        return candidates
+
+    def _find_current_item(self) -> Optional[TreeMenuItem]:
+        """Return current item with tree fields by one query of items matching page."""
+        if not self.current_url:
+            return None
+        storage = TreeMenuItem.get_storage()
+        items: list = list(
+            TreeMenuItem.objects.filter(
+                menu__name=self.menu_name, url__in=self._current_url_candidates()
+            )
+            .order_by(*storage.order_fields)
+            .only(*self.item_fields, "menu_id", *storage.tree_fields)
+        )
+        position: Optional[int] = MenuStructure.from_rows(
+            [(item.pk, item.parent_id, item.name, item.url) for item in items],
+            self._compile_item_html,
+        ).find_item(self.current_url, prefix=menu_settings.URL_PREFIX_MATCH)
+        return None if position is None else items[position]
+
+    def _get_visible_queryset(self, current_item: Optional[TreeMenuItem]):
+        """Get rows of visible items with counts of their children in tree order."""
+        storage = TreeMenuItem.get_storage()
+        items = TreeMenuItem.objects.filter(menu__name=self.menu_name)
+        # only head and ancestors of current item have rendered lists
+        expanded = (
+            items.filter(parent__isnull=True)
+            if current_item is None
+            else storage.ancestors(current_item)
+        )
+        children = items.filter(parent_id__in=expanded.values("pk"))
+        if self.max_depth is not None:
+            children = children.filter(level__lte=self.max_depth)
+        if self.max_siblings is not None:
+            children = children.annotate(
+                sibling_number=Window(
+                    RowNumber(),
+                    partition_by=[F("parent_id")],
+                    order_by=[F(field).asc() for field in storage.order_fields],
+                )
+            ).filter(sibling_number__lte=self.max_siblings)
+        return (
+            TreeMenuItem.objects.filter(
+                Q(pk__in=expanded.values("pk")) | Q(pk__in=children.values("pk"))
+            )
+            .annotate(
+                child_count=Coalesce(
+                    Subquery(
+                        TreeMenuItem.objects.filter(parent_id=OuterRef("pk"))
+                        .order_by()
+                        .values("parent_id")
+                        .annotate(count=Count("pk"))
+                        .values("count")
+                    ),
+                    0,
+                )
+            )
+            .order_by(*storage.order_fields)
+            .values_list(*self.item_fields, "child_count")
+        )
+
+    def _structure_content_key(self) -> str:
+        """Load menu structure and return its content key with markup of menu."""
+        self.__load_structure()
+        return self.__structure.content_key(
+            self.menu_item_html,
+            self.list_menu_items_html,
+            self.css_class_html,
+            self.more_items_html,
+        )
+
+    @classmethod
+    def _get_request_menus(cls, request) -> dict:
+        """Get menus loaded for request."""
+        loaded: Optional[dict] = getattr(request, cls.request_menus_attr, None)
+        if loaded is None:
+            loaded = {}
+            if request is not None:
+                setattr(request, cls.request_menus_attr, loaded)
+        return loaded
+
+    @classmethod
+    def load_menus(cls, request, menu_names) -> dict:
+        """Load versions and structures of menus once per request.
+
+        All menus missing in the request and in the cache are loaded by one query.
+        """
+        loaded: dict = cls._get_request_menus(request)
+        with PhaseTimer("load", menu_names) as timer:
+            sources: dict = {name: "request" for name in menu_names if name in loaded}
+            missing: list = [name for name in menu_names if name not in loaded]
+            if missing:
+                loaded.update(
+                    get_menu_structures(missing, cls._query_to_structures, sources)
+                )
+            timer.info["cache"] = sources
+        return {name: loaded[name] for name in menu_names}
+
+    @classmethod
+    async def aload_menus(cls, request, menu_names) -> dict:
+        """Async version of load_menus.
+
+        Async views can await it before template render, then draw_menu uses loaded menus.
+        """
+        loaded: dict = cls._get_request_menus(request)
+        with PhaseTimer("load", menu_names) as timer:
+            sources: dict = {name: "request" for name in menu_names if name in loaded}
+            missing: list = [name for name in menu_names if name not in loaded]
+            if missing:
+                loaded.update(
+                    await aget_menu_structures(
+                        missing, cls._aquery_to_structures, sources
+                    )
+                )
+            timer.info["cache"] = sources
+        return {name: loaded[name] for name in menu_names}
+
+    @classmethod
+    async def arender(cls, menu_name, request=None, **options) -> str:
+        """Return tree menu html code, menu is loaded by async ORM and cache.
+
+        options: max_depth and max_siblings of rendered menu.
+        """
+        menus: dict = await cls.aload_menus(request, [menu_name])
+        return cls(menu_name, request, menus=menus, **options).render_menu()
+
+    @classmethod
+    async def arender_many(cls, menu_names, request=None) -> dict:
+        """Return html code by menu name, all menus are loaded together by one query."""
+        menus: dict = await cls.aload_menus(request, menu_names)
+        return {
+            name: cls(name, request, menus=menus).render_menu() for name in menu_names
+        }
+
+    def _get_current_url(self) -> list:
+        """Get variants of current url, they are resolved once per request."""
+        if self.request is None:
+            return []
+        current_url: Optional[list] = getattr(
+            self.request, self.request_current_url_attr, None
+        )
+        if current_url is None:
+            with PhaseTimer("url_resolve", [self.menu_name]) as timer:
+                current_url = [
+                    self._get_url(),
+                    self._get_absolute_url(),
+                    self._get_url_name(),
+                ]
+                timer.info["url_name"] = current_url[2]
+            setattr(self.request, self.request_current_url_attr, current_url)
+        return current_url
 
     def _get_url(self) -> str:
         """Get path for current url."""
@@ -34,150 +315,361 @@ class TreeMenu:
         try:
             return resolve(self.request.path_info).url_name
         except Exception as e:
-            print(e)
+            logger.debug(
+                "Url name of %s is not resolved: %s",
+                self.request.path_info,
+                type(e).__name__,
+                extra={"menu_name": self.menu_name, "path": self.request.path_info},
+            )
             return None
 
-    def _get_queryset(self):
-        """Get queryset for all menu`s items by menu name."""
-        return TreeMenuItem.objects.filter(menu__name=self.menu_name)
+    # columns of menu items needed for render
+    item_fields = ("id", "parent_id", "name", "url")
 
-    def __to_url(self, url: str) -> str:
-        """Convert model`s named url to path url."""
-        try:
-            named_url = reverse(url)
-            return named_url
-        except exceptions.NoReverseMatch:
-            return url
-
-    def _query_to_family(self) -> (dict, Optional[int], Optional[TreeMenuItem]):
-        """Generate relation dict for menu`s items, find head`s item and current menu`s item."""
-        family: dict = {}
-        head_item: Optional[int] = None
-        current_item: Optional[TreeMenuItem] = None
-        for obj in self._get_queryset():
-            if family.get(obj.pk) is None:
-                family[obj.pk]: dict = {"children": []}
-            family[obj.pk].update(
-                {
-                    "parent": obj.parent_id,
-                    "name": obj.name,
-                    "obj": obj,
-                    "url": self.__to_url(obj.url),
-                }
-            )
+    @classmethod
+    def _get_queryset(cls, menu_names: List[str]):
+        """Get rows of all items of menus by menu names, the menu name is the last column."""
+        return (
+            TreeMenuItem.objects.filter(menu__name__in=menu_names)
+            .order_by("menu_id", *TreeMenuItem.get_storage().order_fields)
+            .values_list(*cls.item_fields, "menu__name")
+        )
 
-            if obj.parent_id is None:
-                head_item = obj.pk
+    @classmethod
+    def _fetch_rows(cls, menu_names: List[str]) -> list:
+        """Load items of menus by one query."""
+        with PhaseTimer("query", menu_names, count_queries=True) as timer:
+            rows: list = list(cls._get_queryset(menu_names))
+            timer.info["rows"] = len(rows)
+        return rows
 
-            if family.get(obj.parent_id) is None:
-                family[obj.parent_id]: dict = {"children": []}
-            family[obj.parent_id]["children"].append(obj.pk)
+    @classmethod
+    def _rows_to_structures(cls, menu_names: List[str], rows: Iterable[tuple]) -> dict:
+        """Group rows by menu and build structure for every menu."""
+        with PhaseTimer("build", menu_names) as timer:
+            menus_items: dict = {name: [] for name in menu_names}
+            for row in rows:
+                menus_items[row[-1]].append(row)
+            structures: dict = {
+                name: MenuStructure.from_rows(menu_items, cls._compile_item_html)
+                for name, menu_items in menus_items.items()
+            }
+            timer.info["nodes"] = {
+                name: len(structure) for name, structure in structures.items()
+            }
+        return structures
 
-            if obj.url is not None and obj.url in self.current_url:
-                current_item = obj
+    @classmethod
+    def _query_to_structures(cls, menu_names: List[str]) -> dict:
+        """Load items of menus by one query and build structure for every menu."""
+        return cls._rows_to_structures(menu_names, cls._fetch_rows(menu_names))
 
-        return family, head_item, current_item
+    @classmethod
+    async def _aquery_to_structures(cls, menu_names: List[str]) -> dict:
+        """Async version of _query_to_structures."""
+        rows: list = await sync_to_async(cls._fetch_rows)(menu_names)
+        return cls._rows_to_structures(menu_names, rows)
 
-    def _tree_for_render(self) -> Optional[list]:
-        """Prepare tree before render."""
-        if self.__head is None:
-            return None
+    @classmethod
+    def _compile_item_html(cls, name: str, url: str) -> tuple:
+        """Return static html parts of item, they are joined by current css class."""
+        return tuple(
+            part.format(name=escape(name), url=escape(url))
+            for part in cls.menu_item_html.split("{current}")
+        )
 
-        return self._get_children(self.__head)
-
-    def _get_children(self, menu_item_id) -> List[dict]:
-        """Return list of sibling with at children."""
-        result: list = []
-        for child_id in self.__family[menu_item_id]["children"]:
-            item_menu: dict = {
-                "name": self.__family[child_id]["name"],
-                "url": self.__family[child_id]["url"],
-                "current": "current"
-                if self.__current == self.__family[child_id]["obj"]
-                else "",
-            }
-            if (
-                AdminModelsItemMenuChoices.is_child(
-                    self.__family[child_id]["obj"], self.__current
+    @classmethod
+    def _compile_list_html(cls, first: bool) -> (str, str):
+        """Return html before and after items of list."""
+        ul_class = cls.css_class_html if first else ""
+        return tuple(
+            part.format(ul_class=ul_class)
+            for part in cls.list_menu_items_html.split("{menu_items}")
+        )
+
+    def _more_items_html(self, parent: int, offset: int) -> str:
+        return self.more_items_html.format(
+            parent=self.__structure.ids[parent], offset=offset
+        )
+
+    def _list_items(self, parent: int, expanded_child: Optional[int]) -> list:
+        """Return positions of children to render and placeholder of others at the end.
+
+        Expanded child is rendered even after max_siblings children.
+        """
+        children: tuple = self.__structure.children[parent]
+        if (
+            self.max_siblings is None
+            or self.__structure.child_count(parent) <= self.max_siblings
+        ):
+            return list(children)
+        items: list = list(children[: self.max_siblings])
+        if expanded_child is not None and expanded_child not in items:
+            items.append(expanded_child)
+        items.append(self._more_items_html(parent, self.max_siblings))
+        return items
+
+    def __render_by_tree(self) -> str:
+        """Render tree to html code by one pass over expanded items.
+
+        Lists cut by max_siblings and max_depth end with placeholder of other items.
+        Lists deeper than max_depth keep only expanded child, so current item is rendered.
+        """
+        structure: MenuStructure = self.__structure
+        expanded: set = structure.ancestors(self.__current)
+        # expanded child by parent position
+        expanded_children: dict = {
+            structure.parents[position]: position for position in expanded
+        }
+        list_open, list_close = self._compile_list_html(first=False)
+
+        first_open, first_close = self._compile_list_html(first=True)
+        parts: list = [first_open]
+        # stack of (iterator over children, html after children, depth of children)
+        stack: list = [
+            (
+                iter(
+                    self._list_items(
+                        structure.head, expanded_children.get(structure.head)
+                    )
+                ),
+                first_close,
+                1,
+            )
+        ]
+        while stack:
+            children, close_html, depth = stack[-1]
+            position: Optional[int] = next(children, None)
+            if position is None:
+                stack.pop()
+                parts.append(close_html)
+                continue
+            if isinstance(position, str):
+                # placeholder of not rendered items
+                parts.append(position)
+                continue
+
+            parts.append(
+                ("current" if position == self.__current else "").join(
+                    structure.html[position]
+                )
+            )
+            if position not in expanded or structure.child_count(position) == 0:
+                continue
+            if self.max_depth is not None and depth >= self.max_depth:
+                items: list = (
+                    [expanded_children[position]]
+                    if position in expanded_children
+                    else []
                 )
-                or self.__current == self.__family[child_id]["obj"]
-            ):
-                if len(self.__family[child_id]["children"]) > 0:
-                    item_menu["children"]: list = self._get_children(child_id)
-            result.append(item_menu)
+                if structure.child_count(position) > len(items):
+                    items.append(self._more_items_html(position, 0))
+            else:
+                items = self._list_items(position, expanded_children.get(position))
+            parts.append(list_open)
+            stack.append((iter(items), list_close, depth + 1))
+        return "".join(parts)
 
-        return result
+    def render_menu(self) -> SafeString:
+        """Return tree menu safe html code, it is cached for menu version and current item.
 
-    def __render_by_tree(
-        self, for_render_tree: Optional[list], first: bool = True
-    ) -> str:
-        """Render tree to html code."""
-        if first:
-            ul_class = self.css_class_html
-        else:
-            ul_class = ""
-        list_menu_items: str = ""
-        for item_menu in for_render_tree:
-            list_menu_items += self.menu_item_html.format(**item_menu)
-            children: list = item_menu.get("children")
-            if children is not None:
-                list_menu_items += self.__render_by_tree(children, first=False)
-        return self.list_menu_items_html.format(
-            menu_items=list_menu_items, ul_class=ul_class
+        Names and urls of items are escaped.
+        """
+        if self.__prerendered is not None:
+            with PhaseTimer("render", [self.menu_name]) as timer:
+                prerendered_html: Optional[SafeString] = self.__prerendered.find_html(
+                    self.current_url, prefix=menu_settings.URL_PREFIX_MATCH
+                )
+                timer.info["fragment"] = "prerendered"
+            if prerendered_html is not None:
+                return prerendered_html
+            self.__load_structure()
+        if self.__structure is None:
+            return self._render_visible()
+        if self.__structure.head is None:
+            return mark_safe(self._render_html())
+
+        structure: MenuStructure = self.__structure
+        current_id: Optional[int] = (
+            None if self.__current is None else structure.ids[self.__current]
         )
+        with PhaseTimer("render", [self.menu_name]) as timer:
+            html: Optional[str] = get_menu_fragment(
+                self.menu_name, self.version, current_id, self.options
+            )
+            timer.info["fragment"] = "miss" if html is None else "hit"
+            if html is None:
+                html = self._render_html()
+                set_menu_fragment(
+                    self.menu_name, self.version, current_id, html, self.options
+                )
+            if timer.enabled:
+                timer.info["nodes"] = len(structure)
+                timer.info["rendered_nodes"] = sum(
+                    len(structure.children[position])
+                    for position in structure.ancestors(self.__current)
+                    | {structure.head}
+                )
+        return mark_safe(html)
 
-    def render_menu(self) -> str:
-        """Return tree menu html code."""
-        if self.__head is None:
-            return f"Tree menu &lt;{self.menu_name}&gt; not fount"
+    def _render_visible(self) -> SafeString:
+        """Return html of menu loaded by visible items, it is cached by page urls."""
+        page_key: str = hashlib.md5(repr(self.current_url).encode()).hexdigest()
+        with PhaseTimer("render", [self.menu_name]) as timer:
+            html: Optional[str] = get_menu_fragment(
+                self.menu_name, self.version, page_key, self.options
+            )
+            timer.info["fragment"] = "miss" if html is None else "hit"
+        if html is None:
+            self.__load_visible_structure()
+            with PhaseTimer("render", [self.menu_name]) as timer:
+                html = self._render_html()
+                set_menu_fragment(
+                    self.menu_name, self.version, page_key, html, self.options
+                )
+                if timer.enabled:
+                    timer.info["nodes"] = len(self.__structure)
+        return mark_safe(html)
 
-        for_render_tree: Optional[list] = self._tree_for_render()
-        return self.__render_by_tree(for_render_tree)
+    def _render_html(self) -> str:
+        """Return html of menu for current item without fragment cache."""
+        if self.__structure.head is None:
+            return f"Tree menu &lt;{escape(self.menu_name)}&gt; not fount"
+        return self.__render_by_tree()
 
+    def render_variants(self, limit: Optional[int] = None) -> dict:
+        """Render menu for every possible current item, upper items go first.
 
-class AdminModelsItemMenuChoices:
-    def __init__(self, current_item: TreeMenuItem):
-        self.current_item: TreeMenuItem = current_item
-        self.menu_items_qs = TreeMenuItem.objects.select_related("menu").all()
-        self.menu_items: dict = self.__items()
+        Return dict with html by current item id, None is for pages out of menu.
+        Rendered html is not put to fragment cache.
+        """
+        if self.__prerendered is not None:
+            self.__load_structure()
+        structure: MenuStructure = self.__structure
+        current: Optional[int] = self.__current
+        # positions by levels of items, pages out of menu go first
+        positions: list = [None]
+        if structure.head is not None:
+            positions.append(structure.head)
+        for position in positions:
+            if limit is not None and len(positions) >= limit:
+                break
+            if position is not None:
+                positions.extend(structure.children[position])
+        variants: dict = {}
+        for position in positions[:limit]:
+            self.__current = position
+            item_id = None if position is None else structure.ids[position]
+            variants[item_id] = self._render_html()
+        self.__current = current
+        return variants
 
-    @staticmethod
-    def is_child(paren_obj: TreeMenuItem, child_obj: TreeMenuItem) -> bool:
-        """Checks the relationship of objects."""
-        if paren_obj is None or child_obj is None:
-            return False
-        return (
-            paren_obj.left_value < child_obj.left_value
-            and paren_obj.right_value > child_obj.right_value
-            and paren_obj.menu_id == child_obj.menu_id
+    def prerender(self) -> PrerenderedMenu:
+        """Render menu for every current item to serve it without menu structure."""
+        # menu can be created with prerendered menu of previous run instead of structure
+        content_key: str = self._structure_content_key()
+        return PrerenderedMenu.from_variants(
+            self.__structure, self.render_variants(), content_key
         )
 
-    def __items(self) -> dict:
-        """Create dict with all menu items.
 
-        key: menu item id
-        value: include obj and list of children
-        """
-        items: dict = {
-            obj.id: {
-                "obj": obj,
-                "parent": obj.parent_id,
-                "children": [],
+def warm_up_menus(sender, menu_names, **kwargs):
+    """Render top variants of changed menus to shared cache after their change.
+
+    Every process reads html of menu from shared cache once instead of rendering it,
+    TREE_MENU_FRAGMENT_WARM_UP limits count of variants of every menu.
+    """
+    limit: int = menu_settings.FRAGMENT_WARM_UP
+    if not limit or get_cache() is None:
+        return
+    for menu_name in menu_names:
+        menu = TreeMenu(menu_name)
+        variants: dict = menu.render_variants(limit=limit)
+        set_shared_menu_fragments(menu_name, menu.version, variants)
+
+
+def prerender_menu(menu_name: str) -> tuple:
+    """Return version of menu and menu prerendered for every current item."""
+    menu = TreeMenu(menu_name)
+    prerendered: PrerenderedMenu = menu.prerender()
+    return menu.version, prerendered
+
+
+def get_menu_children(item_id: int, offset: int = 0, limit: int = 50) -> dict:
+    """Return page of item`s children for lazy expanded menus by one query.
+
+    next_offset is None for the last page.
+    """
+    storage = TreeMenuItem.get_storage()
+    rows: list = list(
+        TreeMenuItem.objects.filter(parent_id=item_id)
+        .annotate(
+            has_children=Exists(
+                TreeMenuItem.objects.filter(
+                    menu_id=OuterRef("menu_id"), parent_id=OuterRef("pk")
+                )
+            )
+        )
+        .order_by(*storage.order_fields)
+        .values_list("id", "name", "url", "has_children")[offset : offset + limit + 1]
+    )
+    return {
+        "items": [
+            {
+                "id": pk,
+                "name": name,
+                "url": resolve_menu_url(url),
+                "has_children": has_children,
             }
-            for obj in self.menu_items_qs
-        }
+            for pk, name, url, has_children in rows[:limit]
+        ],
+        "next_offset": offset + limit if len(rows) > limit else None,
+    }
 
-        for obj in self.menu_items_qs:
-            if obj.parent_id is not None:
-                items[obj.parent_id]["children"].append(obj.id)
-        return items
 
-    def __all_children(self, obj_id: int) -> list:
-        """Return all children for menu item with children of children."""
-        result: list = self.menu_items[obj_id]["children"]
-        for c in self.menu_items[obj_id]["children"]:
-            result.extend(self.__all_children(c))
-        return result
+class AdminModelsItemMenuChoices:
+    def __init__(
+        self, current_item: Optional[TreeMenuItem], menu_id: Optional[int] = None
+    ):
+        """Choices of parent for item, they are limited by item`s menu or by menu_id for new item."""
+        self.current_item: Optional[TreeMenuItem] = current_item
+        if current_item is not None:
+            menu_id = current_item.menu_id
+        self.menu_id: Optional[int] = menu_id
+        self.menu_items_qs = self._get_queryset()
+
+    @cached_property
+    def tree(self) -> NestedSetIndex:
+        """Index of all items of menu by values of tree storage."""
+        queryset = TreeMenuItem.objects.all()
+        if self.menu_id is not None:
+            queryset = queryset.filter(menu_id=self.menu_id)
+        return NestedSetIndex(TreeMenuItem.get_storage().index_rows(queryset))
+
+    def _get_queryset(self):
+        """Get possible parents in tree order, item`s subtree is excluded."""
+        storage = TreeMenuItem.get_storage()
+        queryset = (
+            TreeMenuItem.objects.select_related("menu")
+            .only("id", "name", "level", "parent_id", "menu__name")
+            .order_by("menu_id", *storage.order_fields)
+        )
+        if self.menu_id is not None:
+            queryset = queryset.filter(menu_id=self.menu_id)
+        if self.current_item is not None:
+            queryset = storage.exclude_descendants(queryset, self.current_item)
+        return queryset
+
+    @staticmethod
+    def is_child(paren_obj: TreeMenuItem, child_obj: TreeMenuItem) -> bool:
+        """Checks the relationship of objects."""
+        if paren_obj is None or child_obj is None or paren_obj.pk == child_obj.pk:
+            return False
+        return TreeMenuItem.get_descendants(paren_obj).filter(pk=child_obj.pk).exists()
+
+    def all_children(self, obj_id: int) -> list:
+        """Return ids of all children for menu item with children of children."""
+        return self.tree.descendants(obj_id)
 
     def __name_as_tree(self, obj: TreeMenuItem) -> str:
         """Return menu item as tree."""
@@ -191,6 +683,5 @@ class AdminModelsItemMenuChoices:
             ("", "-----------"),
         ]
         for obj in self.menu_items_qs:
-            if not self.is_child(self.current_item, obj) and self.current_item != obj:
-                result.append((obj.id, self.__name_as_tree(obj)))
+            result.append((obj.id, self.__name_as_tree(obj)))
         return result
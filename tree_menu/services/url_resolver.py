@@ -0,0 +1,53 @@
+from typing import Dict, List, Tuple
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import exceptions, get_script_prefix, get_urlconf, reverse
+
+# resolved urls of menu items by url configuration and script prefix
+_resolved_urls: Dict[Tuple[str, str], Dict[str, str]] = {}
+
+
+def _is_path_url(url: str) -> bool:
+    """Path and absolute urls are never url names, so reverse is not needed."""
+    return url.startswith("/") or "://" in url
+
+
+def resolve_menu_url(url: str) -> str:
+    """Convert model`s named url to path url, result is remembered for url configuration."""
+    if _is_path_url(url):
+        return url
+
+    resolved_urls: dict = _resolved_urls.setdefault(
+        (get_urlconf(), get_script_prefix()), {}
+    )
+    resolved_url = resolved_urls.get(url)
+    if resolved_url is None:
+        try:
+            resolved_url = reverse(url)
+        except exceptions.NoReverseMatch:
+            resolved_url = url
+        resolved_urls[url] = resolved_url
+    return resolved_url
+
+
+def normalize_url(url: str) -> str:
+    """Return url without query string, fragment and trailing slash."""
+    url = url.split("#", 1)[0].split("?", 1)[0]
+    return url.rstrip("/") or url[:1]
+
+
+def url_segments(path: str) -> List[str]:
+    """Split normalized path url to segments, root path has no segments."""
+    return path.strip("/").split("/") if path.strip("/") else []
+
+
+def clear_resolved_urls() -> None:
+    """Forget all resolved urls."""
+    _resolved_urls.clear()
+
+
+@receiver(setting_changed)
+def clear_resolved_urls_on_urlconf_change(setting, **kwargs):
+    if setting == "ROOT_URLCONF":
+        clear_resolved_urls()
@@ -0,0 +1,13 @@
+from django.dispatch import Signal
+
+# sent after cached structures of menus became outdated, args: menu_names
+menu_invalidated = Signal()
+
+# sent after measured phase of menu loading or rendering, args: phase, menu_names,
+# duration in seconds and counters of phase:
+#   load: cache - source of structure by menu name (request, local, shared, built)
+#   query: queries, rows
+#   build: nodes - count of items by menu name
+#   url_resolve: url_name
+#   render: fragment (hit, miss), nodes, rendered_nodes
+menu_metrics = Signal()
@@ -0,0 +1,476 @@
+from collections import defaultdict
+from typing import Callable, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import CharField, F, Max, Q, QuerySet, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Concat, Substr
+from django.utils.module_loading import import_string
+
+from .conf import menu_settings
+
+# storage instances by (model, storage class path)
+_storages: dict = {}
+
+
+def get_tree_storage(model) -> "TreeStorage":
+    """Return storage of menu tree selected by TREE_MENU_STORAGE setting."""
+    key = (model, menu_settings.STORAGE)
+    if key not in _storages:
+        _storages[key] = import_string(menu_settings.STORAGE)(model)
+    return _storages[key]
+
+
+class TreeStorage:
+    """Way to keep tree of menu`s items in database.
+
+    Storage maintains its fields on save and delete of items. Items of one menu
+    ordered by order_fields go in tree order, children are ordered by name and id.
+    """
+
+    # fields maintained by storage, they are not saved by plain update of item
+    tree_fields: Tuple[str, ...] = ("level",)
+    # fields to order items of one menu in tree order
+    order_fields: Tuple[str, ...] = ()
+    # deepest level of items, head of menu has level 0, None is without limit
+    max_level: Optional[int] = None
+
+    def __init__(self, model):
+        self.model = model
+
+    def insert_node(self, item) -> None:
+        """Set tree fields of new item before insert."""
+        raise NotImplementedError
+
+    def move_node(self, item, old_menu_id: int) -> None:
+        """Move subtree of item to its new parent or menu before update of item."""
+        raise NotImplementedError
+
+    def delete_node(self, item, delete: Callable):
+        """Delete item with its subtree by delete callable and return its result."""
+        return delete()
+
+    def rebuild(self, menu_id: int) -> None:
+        """Recalculate tree fields for all menu`s items."""
+        raise NotImplementedError
+
+    def defer_move(self, item, old_menu_id: int) -> None:
+        """Move subtree of item without tree fields, they are set by later rebuild."""
+        subtree = self._recursive_descendants(item)
+        if old_menu_id == item.menu_id:
+            if subtree.filter(pk=item.parent_id).exists():
+                raise ValueError("Menu item can not be moved into own subtree.")
+        else:
+            subtree.update(menu_id=item.menu_id)
+
+    def imported(self, menu_id: int) -> None:
+        """Fill tree fields after bulk insert of menu`s items."""
+        self.rebuild(menu_id)
+
+    def descendants(self, item) -> QuerySet:
+        """Return queryset of item and all its descendants."""
+        raise NotImplementedError
+
+    def ancestors(self, item) -> QuerySet:
+        """Return queryset of item and all its ancestors."""
+        raise NotImplementedError
+
+    def exclude_descendants(self, queryset: QuerySet, item) -> QuerySet:
+        """Exclude item and its descendants from queryset."""
+        return queryset.exclude(pk__in=self.descendants(item).values("pk"))
+
+    def index_rows(self, queryset: QuerySet) -> Iterable[tuple]:
+        """Return rows for NestedSetIndex, subtree of item must be continuous range."""
+        raise NotImplementedError
+
+    def _recursive_descendants(self, item) -> QuerySet:
+        """Descendants by recursive query, they are used while tree fields are not built."""
+        sql = """
+            WITH RECURSIVE descendants(id, name, url, menu_id, parent_id) AS (
+                SELECT id, name, url, menu_id, parent_id FROM {table} WHERE id = %s
+                UNION ALL
+                SELECT {table}.id, {table}.name, {table}.url, {table}.menu_id, {table}.parent_id FROM descendants
+                JOIN {table} ON descendants.id = {table}.parent_id
+            )
+            SELECT id FROM descendants
+        """.format(table=self.model._meta.db_table)
+
+        return self.model.objects.filter(id__in=RawSQL(sql, [item.id]))
+
+    def _move_by_rebuild(self, item, old_menu_id: int) -> None:
+        """Move item by full rebuild of its menus, tree fields of item are refreshed."""
+        self.model.objects.filter(pk=item.pk).update(
+            parent_id=item.parent_id, menu_id=item.menu_id
+        )
+        self.rebuild(item.menu_id)
+        if old_menu_id != item.menu_id:
+            self.rebuild(old_menu_id)
+        item.refresh_from_db(fields=self.tree_fields)
+
+    def _next_siblings(self, item) -> QuerySet:
+        """Return siblings ordered after item by name and id, as rebuild orders them."""
+        siblings = self.model.objects.filter(parent_id=item.parent_id)
+        if item.pk is None:
+            # new item gets the greatest id, so it goes after siblings with its name
+            return siblings.filter(name__gt=item.name)
+        return siblings.filter(
+            Q(name__gt=item.name) | Q(name=item.name, pk__gt=item.pk)
+        )
+
+    def _load_for_rebuild(self, menu_id: int, *fields: str) -> dict:
+        """Lock menu`s items and return them by parent id, ordered by name and id."""
+        items = (
+            self.model.objects.select_for_update()
+            .filter(menu_id=menu_id)
+            .only("id", "parent_id", "menu_id", *fields)
+            .order_by("name", "pk")
+        )
+        children: dict = defaultdict(list)
+        for item in items:
+            children[item.parent_id].append(item)
+        return children
+
+
+class NestedSetStorage(TreeStorage):
+    """Nested set values, reads of subtree are one range query, writes shift values.
+
+    Every insert, move and delete updates values of all items to the right of it.
+    """
+
+    tree_fields = ("left_value", "right_value", "level")
+    order_fields = ("left_value",)
+
+    def _get_insert_position(self, item) -> Tuple[int, int]:
+        """Return left value and level for item as child of its parent.
+
+        Children are ordered by name and id, as rebuild does.
+        """
+        parent_right, parent_level = (
+            self.model.objects.filter(pk=item.parent_id)
+            .values_list("right_value", "level")
+            .get()
+        )
+        next_sibling_left = (
+            self._next_siblings(item)
+            .order_by("left_value")
+            .values_list("left_value", flat=True)
+            .first()
+        )
+        if next_sibling_left is None:
+            return parent_right, parent_level + 1
+        return next_sibling_left, parent_level + 1
+
+    def _open_gap(self, menu_id, position: int, width: int):
+        """Shift items to free nested set values from position."""
+        items = self.model.objects.filter(menu_id=menu_id)
+        items.filter(right_value__gte=position).update(
+            right_value=F("right_value") + width
+        )
+        items.filter(left_value__gte=position).update(
+            left_value=F("left_value") + width
+        )
+
+    def _close_gap(self, menu_id, right: int, width: int):
+        """Shift items to close gap of nested set values after removed subtree."""
+        items = self.model.objects.filter(menu_id=menu_id)
+        items.filter(left_value__gt=right).update(left_value=F("left_value") - width)
+        items.filter(right_value__gt=right).update(right_value=F("right_value") - width)
+
+    def insert_node(self, item) -> None:
+        if item.parent_id is None:
+            item.left_value, item.right_value, item.level = 1, 2, 0
+            return
+        item.left_value, item.level = self._get_insert_position(item)
+        item.right_value = item.left_value + 1
+        self._open_gap(item.menu_id, item.left_value, 2)
+
+    def move_node(self, item, old_menu_id: int) -> None:
+        lft, rght, level = (
+            self.model.objects.filter(pk=item.pk).values_list(*self.tree_fields).get()
+        )
+        if lft < 1 or item.parent_id is None:
+            # values were never built or item become root, so rebuild full menus
+            self._move_by_rebuild(item, old_menu_id)
+            return
+
+        if (
+            old_menu_id == item.menu_id
+            and self.model.objects.filter(
+                pk=item.parent_id, left_value__gte=lft, right_value__lte=rght
+            ).exists()
+        ):
+            raise ValueError("Menu item can not be moved into own subtree.")
+
+        width = rght - lft + 1
+        # exclude subtree from nested set by negative values
+        subtree = self.model.objects.filter(
+            menu_id=old_menu_id, left_value__gte=lft, right_value__lte=rght
+        )
+        subtree.update(left_value=-F("left_value"), right_value=-F("right_value"))
+        self._close_gap(old_menu_id, rght, width)
+
+        position, new_level = self._get_insert_position(item)
+        self._open_gap(item.menu_id, position, width)
+        # negative range of subtree, it never includes -1 of items without values
+        self.model.objects.filter(
+            menu_id=old_menu_id, left_value__range=(-rght, -lft)
+        ).update(
+            left_value=(position - lft) - F("left_value"),
+            right_value=(position - lft) - F("right_value"),
+            level=F("level") + (new_level - level),
+            menu_id=item.menu_id,
+        )
+        item.left_value, item.right_value, item.level = (
+            position,
+            position + width - 1,
+            new_level,
+        )
+
+    def delete_node(self, item, delete: Callable):
+        lft, rght = (
+            self.model.objects.filter(pk=item.pk)
+            .values_list("left_value", "right_value")
+            .get()
+        )
+        result = delete()
+        if lft > 0:
+            self._close_gap(item.menu_id, rght, rght - lft + 1)
+        return result
+
+    def rebuild(self, menu_id: int) -> None:
+        """Items are loaded by one query, values are calculated in memory
+        and changed items are saved by one bulk update.
+        """
+        with transaction.atomic():
+            children: dict = self._load_for_rebuild(menu_id, *self.tree_fields)
+            changed = self._build_menu_items(children[None][0], children)
+            self.model.objects.bulk_update(changed, self.tree_fields)
+
+    def imported(self, menu_id: int) -> None:
+        # import calculates nested set values itself
+        pass
+
+    @staticmethod
+    def _build_menu_items(root_obj, children: dict) -> list:
+        """Set nested set values for items by depth-first traversal.
+
+        Return list of items with changed values.
+        """
+        changed: list = []
+        value = 1
+        # stack of (item, left value, level, iterator over item`s children)
+        stack: list = [(root_obj, value, 0, iter(children[root_obj.pk]))]
+        while stack:
+            obj, lft, level, obj_children = stack[-1]
+            child = next(obj_children, None)
+            value += 1
+            if child is None:
+                stack.pop()
+                values = (lft, value, level)
+                if values != (obj.left_value, obj.right_value, obj.level):
+                    obj.left_value, obj.right_value, obj.level = values
+                    changed.append(obj)
+            else:
+                stack.append((child, value, level + 1, iter(children[child.pk])))
+        return changed
+
+    def descendants(self, item) -> QuerySet:
+        if item.left_value < 1:
+            return self._recursive_descendants(item)
+        return self.model.objects.filter(
+            menu_id=item.menu_id,
+            left_value__gte=item.left_value,
+            right_value__lte=item.right_value,
+        )
+
+    def ancestors(self, item) -> QuerySet:
+        return self.model.objects.filter(
+            menu_id=item.menu_id,
+            left_value__lte=item.left_value,
+            right_value__gte=item.right_value,
+        )
+
+    def exclude_descendants(self, queryset: QuerySet, item) -> QuerySet:
+        return queryset.exclude(
+            menu_id=item.menu_id,
+            left_value__gte=item.left_value,
+            right_value__lte=item.right_value,
+        )
+
+    def index_rows(self, queryset: QuerySet) -> Iterable[tuple]:
+        return queryset.values_list(
+            "id", "parent_id", "menu_id", "left_value", "right_value", "level"
+        )
+
+
+class MaterializedPathStorage(TreeStorage):
+    """Materialized path, subtree is prefix query and writes touch only moved subtree.
+
+    Path of item is path of its parent and fixed width key of item among siblings.
+    Keys of new items are taken between keys of neighbours by name, so siblings
+    are not renumbered; only when there is no free key the menu is rebuilt.
+    Path column has 255 chars, so menu can have up to 42 levels.
+    """
+
+    tree_fields = ("path", "level")
+    order_fields = ("path",)
+
+    alphabet = "0123456789abcdefghijklmnopqrstuvwxyz"
+    key_width = 6
+    max_key = len(alphabet) ** key_width
+    # distance between keys of siblings appended to the end
+    key_step = len(alphabet) ** 3
+
+    @property
+    def max_level(self) -> int:
+        return self.model._meta.get_field("path").max_length // self.key_width - 1
+
+    def _encode(self, number: int) -> str:
+        chars: list = []
+        for _ in range(self.key_width):
+            number, rest = divmod(number, len(self.alphabet))
+            chars.append(self.alphabet[rest])
+        return "".join(reversed(chars))
+
+    def _key_between(self, prev_key: Optional[str], next_key: Optional[str]):
+        """Return key between keys of neighbours or None if there is no free key."""
+        low: int = 0 if prev_key is None else int(prev_key, len(self.alphabet))
+        high: int = (
+            self.max_key if next_key is None else int(next_key, len(self.alphabet))
+        )
+        if high - low < 2:
+            return None
+        if next_key is None:
+            return self._encode(low + min(self.key_step, (high - low) // 2))
+        return self._encode((low + high) // 2)
+
+    def _get_child_path(self, item) -> Optional[Tuple[str, int]]:
+        """Return path and level for item as child of its parent, None if no free key."""
+        parent_path, parent_level = (
+            self.model.objects.filter(pk=item.parent_id)
+            .values_list("path", "level")
+            .get()
+        )
+        siblings = self.model.objects.filter(
+            menu_id=item.menu_id, parent_id=item.parent_id
+        ).exclude(pk=item.pk)
+        next_path: Optional[str] = (
+            self._next_siblings(item)
+            .order_by("path")
+            .values_list("path", flat=True)
+            .first()
+        )
+        if next_path is not None:
+            siblings = siblings.filter(path__lt=next_path)
+        prev_path: Optional[str] = (
+            siblings.order_by("-path").values_list("path", flat=True).first()
+        )
+        key: Optional[str] = self._key_between(
+            prev_path[-self.key_width :] if prev_path else None,
+            next_path[-self.key_width :] if next_path else None,
+        )
+        if key is None:
+            return None
+        return parent_path + key, parent_level + 1
+
+    def _get_free_child_path(self, item, subtree_depth: int = 0) -> Tuple[str, int]:
+        """Return path and level for item, the menu is rebuilt to free keys if needed.
+
+        subtree_depth: levels of item`s subtree below item, they must fit in path too.
+        """
+        child_path: Optional[Tuple[str, int]] = self._get_child_path(item)
+        if child_path is None:
+            self.rebuild(item.menu_id)
+            child_path = self._get_child_path(item)
+        max_length: int = self.model._meta.get_field("path").max_length
+        if len(child_path[0]) + subtree_depth * self.key_width > max_length:
+            raise ValueError("Menu is too deep for materialized path storage.")
+        return child_path
+
+    def insert_node(self, item) -> None:
+        if item.parent_id is None:
+            item.path, item.level = self._encode(self.key_step), 0
+            return
+        item.path, item.level = self._get_free_child_path(item)
+
+    def move_node(self, item, old_menu_id: int) -> None:
+        old_path, old_level = (
+            self.model.objects.filter(pk=item.pk).values_list("path", "level").get()
+        )
+        if not old_path or item.parent_id is None:
+            # paths were never built or item become root, so rebuild full menus
+            self._move_by_rebuild(item, old_menu_id)
+            return
+
+        if (
+            old_menu_id == item.menu_id
+            and self.model.objects.filter(
+                pk=item.parent_id, menu_id=old_menu_id, path__startswith=old_path
+            ).exists()
+        ):
+            raise ValueError("Menu item can not be moved into own subtree.")
+
+        subtree = self.model.objects.filter(
+            menu_id=old_menu_id, path__startswith=old_path
+        )
+        subtree_level: int = subtree.aggregate(level=Max("level"))["level"]
+        new_path, new_level = self._get_free_child_path(item, subtree_level - old_level)
+        subtree.update(
+            path=Concat(
+                Value(new_path),
+                Substr("path", len(old_path) + 1),
+                output_field=CharField(),
+            ),
+            level=F("level") + (new_level - old_level),
+            menu_id=item.menu_id,
+        )
+        item.path, item.level = new_path, new_level
+
+    def rebuild(self, menu_id: int) -> None:
+        """Keys of siblings are spread evenly, changed items are saved by one bulk update."""
+        with transaction.atomic():
+            children: dict = self._load_for_rebuild(menu_id, *self.tree_fields)
+            max_length: int = self.model._meta.get_field("path").max_length
+            changed: list = []
+            # stack of (item, path, level)
+            stack: list = [(children[None][0], self._encode(self.key_step), 0)]
+            while stack:
+                obj, path, level = stack.pop()
+                if len(path) > max_length:
+                    raise ValueError("Menu is too deep for materialized path storage.")
+                if (path, level) != (obj.path, obj.level):
+                    obj.path, obj.level = path, level
+                    changed.append(obj)
+                obj_children: list = children[obj.pk]
+                step: int = min(self.key_step, self.max_key // (len(obj_children) + 1))
+                for number, child in enumerate(obj_children, start=1):
+                    stack.append((child, path + self._encode(step * number), level + 1))
+            self.model.objects.bulk_update(changed, self.tree_fields)
+
+    def descendants(self, item) -> QuerySet:
+        if not item.path:
+            return self._recursive_descendants(item)
+        return self.model.objects.filter(
+            menu_id=item.menu_id, path__startswith=item.path
+        )
+
+    def ancestors(self, item) -> QuerySet:
+        return self.model.objects.filter(
+            menu_id=item.menu_id,
+            path__in=[
+                item.path[:end]
+                for end in range(self.key_width, len(item.path) + 1, self.key_width)
+            ],
+        )
+
+    def exclude_descendants(self, queryset: QuerySet, item) -> QuerySet:
+        return queryset.exclude(menu_id=item.menu_id, path__startswith=item.path)
+
+    def index_rows(self, queryset: QuerySet) -> Iterable[tuple]:
+        # path followed by a char greater than any key char closes the subtree range
+        return (
+            (pk, parent_id, menu_id, path, path + "~", level)
+            for pk, parent_id, menu_id, path, level in queryset.values_list(
+                "id", "parent_id", "menu_id", "path", "level"
+            )
+        )
@@ -1,15 +1,39 @@
 from django import template
+from django.utils.safestring import SafeString
 
+from ..conf import menu_settings
 from ..services.tree_menu import TreeMenu
 
 register = template.Library()
 
 
-@register.inclusion_tag(filename="tree_menu.html", name="draw_menu", takes_context=True)
-def draw_menu(context, menu_name):
-    tree_menu = TreeMenu(menu_name, context.request)
+@register.simple_tag(name="load_menus", takes_context=True)
+def load_menus(context, *menu_names):
+    """Load all menus of page by one query before drawing them.
 
-    return {
-        "tree_menu": tree_menu.render_menu(),
-        "menu_name": menu_name,
-    }
+    With TREE_MENU_PRERENDERED menus are not loaded, draw_menu takes prerendered menus.
+    """
+    if menu_settings.PRERENDERED:
+        return ""
+    TreeMenu.load_menus(context.request, menu_names)
+    return ""
+
+
+@register.simple_tag(name="draw_menu", takes_context=True)
+def draw_menu(context, menu_name, max_depth=None, max_siblings=None) -> SafeString:
+    """Draw menu, levels after max_depth and children after max_siblings are cut.
+
+    Cut lists end with placeholder, its items are loaded by tree_menu_children view.
+    Menu html is returned without template, unless TREE_MENU_TEMPLATE is set.
+    """
+    tree_menu = TreeMenu(
+        menu_name, context.request, max_depth=max_depth, max_siblings=max_siblings
+    )
+    html: SafeString = tree_menu.render_menu()
+    if menu_settings.TEMPLATE is None:
+        return html
+    # the same way as inclusion tag, but only for overridden markup
+    menu_template = context.template.engine.get_template(menu_settings.TEMPLATE)
+    return menu_template.render(
+        context.new({"tree_menu": html, "menu_name": menu_name})
+    )
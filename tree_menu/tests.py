@@ -1,3 +1,898 @@
-from django.test import TestCase
+import json
+import multiprocessing
+import shutil
+import tempfile
+from io import StringIO
+from typing import Optional
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Max
+from django.template import RequestContext, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_script_prefix, reverse, set_script_prefix
+
+from .admin import EstimatedCountPaginator, TreeMenuItemsAdmin
+from .cache import (
+    fragment_cache,
+    get_cache,
+    get_menu_fragment,
+    invalidate_menu,
+    local_cache,
+    prerendered_cache,
+)
+from .models import TreeMenu, TreeMenuItem
+from .rebuild import deferred_rebuild, rebuild_menus
+from .services import AdminModelsItemMenuChoices
+from .services import TreeMenu as TreeMenuService
+from .services import import_menu
+from .services.benchmark import BaselineTreeMenu, generate_menu_items
+from .services.menu_structure import MenuStructure
+from .services.url_resolver import resolve_menu_url
+from .signals import menu_invalidated, menu_metrics
+
+NESTED_SET_STORAGE = "tree_menu.storages.NestedSetStorage"
+MATERIALIZED_PATH_STORAGE = "tree_menu.storages.MaterializedPathStorage"
+
+
+def clear_menu_caches():
+    """Caches outlive test transactions, their menus would be used by next tests."""
+    get_cache().clear()
+    local_cache.clear()
+    fragment_cache.clear()
+    prerendered_cache.clear()
+
+
+class TreeStorageTestMixin:
+    """Tree fields after every change must be the same as after full rebuild."""
+
+    def setUp(self):
+        self.menu = TreeMenu.objects.create(name="main")
+        self.root = TreeMenuItem.objects.get(menu=self.menu, parent=None)
+        self.b = self.add_item("b", self.root)
+        self.a = self.add_item("a", self.root)
+        self.a2 = self.add_item("a2", self.a)
+        self.a1 = self.add_item("a1", self.a)
+        self.a11 = self.add_item("a11", self.a1)
+        self.c = self.add_item("c", self.root)
+
+    def add_item(self, name: str, parent: TreeMenuItem, url: str = "") -> TreeMenuItem:
+        return TreeMenuItem.objects.create(
+            name=name,
+            url=url or f"/{parent.menu.name}/{name}/",
+            parent=parent,
+            menu=parent.menu,
+        )
+
+    def tree_state(self, menu_id: int) -> list:
+        """Items of menu in tree order with their parents, levels and tree values.
+
+        Paths are left out, rebuild spreads keys of siblings in other way.
+        """
+        storage = TreeMenuItem.get_storage()
+        fields = [field for field in storage.tree_fields if field != "path"]
+        return list(
+            TreeMenuItem.objects.filter(menu_id=menu_id)
+            .order_by(*storage.order_fields)
+            .values_list("name", "parent_id", *fields)
+        )
+
+    def assertTreeRebuilt(self, menu: TreeMenu, names: list):
+        state = self.tree_state(menu.pk)
+        self.assertEqual([row[0] for row in state], names)
+        TreeMenuItem.get_storage().rebuild(menu.pk)
+        self.assertEqual(state, self.tree_state(menu.pk))
+
+    def descendant_names(self, item: TreeMenuItem) -> list:
+        item.refresh_from_db()
+        return sorted(TreeMenuItem.get_descendants(item).values_list("name", flat=True))
+
+    def test_insert(self):
+        self.add_item("a0", self.a)
+        self.add_item("a12", self.a1)
+        self.assertTreeRebuilt(
+            self.menu, ["main", "a", "a0", "a1", "a11", "a12", "a2", "b", "c"]
+        )
+        self.assertEqual(self.descendant_names(self.a1), ["a1", "a11", "a12"])
+
+    def test_move(self):
+        self.a1.parent = self.c
+        self.a1.save()
+        self.assertTreeRebuilt(self.menu, ["main", "a", "a2", "b", "c", "a1", "a11"])
+        self.assertEqual(self.descendant_names(self.c), ["a1", "a11", "c"])
+        self.assertEqual(self.descendant_names(self.a), ["a", "a2"])
+
+    def test_move_with_unbuilt_item(self):
+        # item inserted by deferred block keeps default tree values until rebuild
+        with deferred_rebuild(background=True):
+            b1 = self.add_item("b1", self.b)
+        fields = TreeMenuItem.get_storage().tree_fields
+        unbuilt = TreeMenuItem.objects.filter(pk=b1.pk).values_list(*fields).get()
+        self.a1.parent = self.c
+        self.a1.save()
+        self.assertEqual(
+            TreeMenuItem.objects.filter(pk=b1.pk).values_list(*fields).get(), unbuilt
+        )
+        b1.delete()
+        self.assertTreeRebuilt(self.menu, ["main", "a", "a2", "b", "c", "a1", "a11"])
+
+    def test_same_names(self):
+        # siblings with same name are ordered by id, as rebuild orders them
+        first = self.add_item("a1", self.c, "/main/c/a1/")
+        self.add_item("a1", self.c, "/main/c/a1/2/")
+        self.a1.parent = self.c
+        self.a1.save()
+        first.parent = self.a
+        first.save()
+        self.assertTreeRebuilt(
+            self.menu, ["main", "a", "a1", "a2", "b", "c", "a1", "a11", "a1"]
+        )
+
+    def test_move_to_other_menu(self):
+        other = TreeMenu.objects.create(name="other")
+        other_root = TreeMenuItem.objects.get(menu=other, parent=None)
+        self.add_item("x", other_root)
+        self.a.parent, self.a.menu = other_root, other
+        self.a.save()
+        self.assertTreeRebuilt(self.menu, ["main", "b", "c"])
+        self.assertTreeRebuilt(other, ["other", "a", "a1", "a11", "a2", "x"])
+        self.assertEqual(self.descendant_names(self.a1), ["a1", "a11"])
+
+    def test_move_into_own_subtree(self):
+        state = self.tree_state(self.menu.pk)
+        self.a.parent = self.a11
+        with self.assertRaises(ValueError):
+            self.a.save()
+        self.assertEqual(state, self.tree_state(self.menu.pk))
+
+    def test_delete(self):
+        self.a1.delete()
+        self.assertTreeRebuilt(self.menu, ["main", "a", "a2", "b", "c"])
+        self.assertEqual(
+            self.descendant_names(self.root), ["a", "a2", "b", "c", "main"]
+        )
+
+    def test_index(self):
+        choices = AdminModelsItemMenuChoices(None, self.menu.pk)
+        tree = choices.tree
+        self.assertEqual(
+            tree.descendants(self.a.pk), [self.a1.pk, self.a11.pk, self.a2.pk]
+        )
+        self.assertEqual(tree.descendants(self.a11.pk), [])
+        self.assertEqual(choices.all_children(self.a1.pk), [self.a11.pk])
+        self.assertEqual(
+            tree.ancestors(self.a11.pk), [self.root.pk, self.a.pk, self.a1.pk]
+        )
+        self.assertEqual(tree.siblings(self.a.pk), [self.b.pk, self.c.pk])
+        self.assertEqual(tree.depth(self.a11.pk), 3)
+        self.assertTrue(tree.is_descendant(self.a11.pk, self.a.pk))
+        self.assertFalse(tree.is_descendant(self.a.pk, self.a11.pk))
+        self.a.refresh_from_db()
+        self.assertTrue(choices.is_child(self.a, self.a11))
+        self.assertFalse(choices.is_child(self.a11, self.a))
+
+    def test_deep_menu(self):
+        max_level = TreeMenuItem.get_storage().max_level
+        menu = import_menu("deep", generate_menu_items("deep", 60, max_level=max_level))
+        self.assertEqual(
+            menu.menu_tree_items.aggregate(level=Max("level"))["level"],
+            min(60, max_level or 60),
+        )
+
+    def test_deferred_fields(self):
+        for queryset in (
+            TreeMenuItem.objects.only("id", "name"),
+            TreeMenuItem.objects.defer("menu"),
+            TreeMenuItem.objects.defer("parent"),
+        ):
+            item = queryset.get(pk=self.a1.pk)
+            self.assertEqual((item.parent_id, item.menu_id), (self.a.pk, self.menu.pk))
+
+        item = TreeMenuItem.objects.only("id", "name").get(pk=self.a1.pk)
+        item.name = "a3"
+        item.save()
+        item = TreeMenuItem.objects.only("id", "name").get(pk=self.a1.pk)
+        item.parent_id = self.b.pk
+        item.save()
+        self.assertTreeRebuilt(self.menu, ["main", "a", "a2", "b", "a3", "a11", "c"])
+
+
+@override_settings(TREE_MENU_STORAGE=NESTED_SET_STORAGE)
+class NestedSetStorageTest(TreeStorageTestMixin, TestCase):
+    pass
+
+
+@override_settings(TREE_MENU_STORAGE=MATERIALIZED_PATH_STORAGE)
+class MaterializedPathStorageTest(TreeStorageTestMixin, TestCase):
+    pass
+
+
+class DeferredRebuildTest(TestCase):
+    def setUp(self):
+        self.menu = import_menu(
+            "main",
+            [
+                {"name": "a", "url": "/a/", "children": []},
+                {"name": "b", "url": "/b/", "children": []},
+            ],
+        )
+        self.a, self.b = TreeMenuItem.objects.filter(menu=self.menu, level=1)
+        self.invalidated: list = []
+        menu_invalidated.connect(self.receiver)
+        self.addCleanup(menu_invalidated.disconnect, self.receiver)
+        rebuild_menu = mock.patch.object(
+            TreeMenuItem, "rebuild_menu", wraps=TreeMenuItem.rebuild_menu
+        )
+        self.rebuild_menu = rebuild_menu.start()
+        self.addCleanup(rebuild_menu.stop)
+
+    def receiver(self, menu_names, **kwargs):
+        self.invalidated.extend(menu_names)
+
+    def change_items(self):
+        a1 = TreeMenuItem.objects.create(
+            name="a1", url="/a/1/", parent=self.a, menu=self.menu
+        )
+        TreeMenuItem.objects.create(
+            name="a2", url="/a/2/", parent=self.a, menu=self.menu
+        )
+        a1.parent = self.b
+        a1.save()
+        self.b.name = "c"
+        self.b.save()
+        self.a.delete()
+
+    def assertRebuiltOnce(self):
+        self.rebuild_menu.assert_called_once_with(self.menu.pk)
+        self.assertEqual(self.invalidated, ["main"])
+        self.assertEqual(
+            list(
+                TreeMenuItem.objects.filter(menu=self.menu)
+                .order_by("left_value")
+                .values_list("name", "left_value", "right_value", "level")
+            ),
+            [("main", 1, 6, 0), ("c", 2, 5, 1), ("a1", 3, 4, 2)],
+        )
+
+    def test_single_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with deferred_rebuild():
+                self.change_items()
+        # the only callback is invalidation of rebuilt menu
+        self.assertEqual(len(callbacks), 1)
+        self.assertRebuiltOnce()
+
+    def test_nested_blocks(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with deferred_rebuild():
+                with deferred_rebuild(background=True):
+                    self.change_items()
+                self.rebuild_menu.assert_not_called()
+        self.assertRebuiltOnce()
+
+    @mock.patch("tree_menu.rebuild._submit_rebuild", side_effect=rebuild_menus)
+    def test_background(self, submit_rebuild):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with deferred_rebuild(background=True):
+                self.change_items()
+        # menu is rebuilt by worker after commit
+        self.assertEqual(len(callbacks), 1)
+        self.rebuild_menu.assert_not_called()
+        with self.captureOnCommitCallbacks(execute=True):
+            callbacks[0]()
+        submit_rebuild.assert_called_once_with({self.menu.pk})
+        self.assertRebuiltOnce()
+
+
+class ImportMenuTest(TestCase):
+    def import_file(self, data):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as file:
+            json.dump(data, file)
+            file.flush()
+            call_command("import_menu", file.name, stdout=None)
+
+    def test_import(self):
+        items = [
+            {"name": "b", "url": "/b/", "children": []},
+            {"name": "a", "url": "/a/", "children": [{"name": "a1", "url": "/a/1/"}]},
+        ]
+        menu = import_menu("main", items)
+        self.assertEqual(
+            list(
+                menu.menu_tree_items.order_by("left_value").values_list(
+                    "name", "left_value", "right_value", "level"
+                )
+            ),
+            [("main", 1, 8, 0), ("a", 2, 5, 1), ("a1", 3, 4, 2), ("b", 6, 7, 1)],
+        )
+
+    def test_invalid_items(self):
+        for items in (
+            [{"url": "/a/"}],
+            [{"name": "a"}],
+            [{"name": "a" * 51, "url": "/a/"}],
+            [{"name": "a", "url": "/a/"}, {"name": "b", "url": "/a/"}],
+            [{"name": "a", "url": "/a/", "children": [{"name": "a", "url": "/a/"}]}],
+            [{"name": "a", "url": "/a/", "children": {"name": "b"}}],
+            [{"name": "a", "url": "not url"}],
+            ["a"],
+        ):
+            with self.subTest(items=items), self.assertRaises(CommandError):
+                self.import_file({"name": "main", "items": items})
+        self.assertFalse(TreeMenu.objects.filter(name="main").exists())
+
+    def test_invalid_url(self):
+        with self.assertRaisesMessage(ValueError, "'not url'"):
+            import_menu("main", [{"name": "a", "url": "not url"}])
+
+    def test_invalid_menu(self):
+        for data in ({"items": []}, {"name": "m" * 51, "items": []}, []):
+            with self.subTest(data=data), self.assertRaises(CommandError):
+                self.import_file(data)
+
+
+class MenuCacheTest(TestCase):
+    def setUp(self):
+        clear_menu_caches()
+        import_menu("main", [{"name": "news", "url": "news", "children": []}])
+
+    def render_with_script_prefix(self, prefix: str) -> str:
+        old_prefix: str = get_script_prefix()
+        set_script_prefix(prefix)
+        try:
+            return TreeMenuService("main").render_menu()
+        finally:
+            set_script_prefix(old_prefix)
+
+    def test_url_context(self):
+        # structures and html are cached, but urls are resolved for every script prefix
+        for _ in range(2):
+            self.assertIn('href="/example/news"', self.render_with_script_prefix("/"))
+            self.assertIn(
+                'href="/sub/example/news"', self.render_with_script_prefix("/sub/")
+            )
+
+    def test_deferred_name(self):
+        TreeMenu.objects.create(name="other")
+        with self.assertNumQueries(1):
+            menus = {str(menu.pk): menu for menu in TreeMenu.objects.only("id")}
+        menu = menus[str(TreeMenu.objects.get(name="main").pk)]
+        self.assertIn(">news<", TreeMenuService("main").render_menu())
+        # cache of old name is invalidated after rename of menu without loaded name
+        menu.name = "renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            menu.save()
+        self.assertNotIn(">news<", TreeMenuService("main").render_menu())
+
+    @override_settings(TREE_MENU_FRAGMENT_WARM_UP=2)
+    def test_warm_up(self):
+        invalidate_menu("main")
+        fragment_cache.clear()
+        menu = TreeMenuService("main")
+        root_id, news_id = TreeMenuItem.objects.filter(menu__name="main").values_list(
+            "id", flat=True
+        )
+        # html rendered by process which changed menu is read from shared cache
+        self.assertEqual(
+            get_menu_fragment("main", menu.version, None), menu.render_menu()
+        )
+        self.assertIsNotNone(get_menu_fragment("main", menu.version, root_id))
+        self.assertIsNone(get_menu_fragment("main", menu.version, news_id))
+
+
+class BaselineRenderTest(TestCase):
+    fixtures = [str(settings.BASE_DIR / "tree_menu.json")]
+
+    def setUp(self):
+        clear_menu_caches()
+
+    def test_same_html_as_baseline(self):
+        factory = RequestFactory()
+        menu_names: list = list(TreeMenu.objects.values_list("name", flat=True))
+        urls: list = list(
+            TreeMenuItem.objects.filter(parent__isnull=False).values_list(
+                "url", flat=True
+            )
+        )
+        for url in urls:
+            page: str = resolve_menu_url(url)
+            for menu_name in menu_names:
+                with self.subTest(page=page, menu_name=menu_name):
+                    self.assertEqual(
+                        TreeMenuService(menu_name, factory.get(page)).render_menu(),
+                        BaselineTreeMenu(menu_name, factory.get(page)).render_menu(),
+                    )
+
+
+class UrlMatcherTest(TestCase):
+    def setUp(self):
+        clear_menu_caches()
+        self.structure = MenuStructure.from_rows(
+            [
+                (1, None, "main", "/"),
+                (2, 1, "news", "/news/"),
+                (3, 2, "item", "/news/item"),
+                (4, 1, "page", "https://example.com/page/"),
+            ],
+            lambda name, url: (name,),
+        )
+
+    def find(self, *urls, prefix: bool = False) -> Optional[str]:
+        position: Optional[int] = self.structure.find_item(urls, prefix=prefix)
+        return None if position is None else self.structure.names[position]
+
+    def test_normalized_url(self):
+        self.assertEqual(self.find("/news"), "news")
+        self.assertEqual(self.find("/news/item/"), "item")
+        self.assertEqual(self.find("/news/?page=2"), "news")
+        self.assertEqual(self.find("/news/item?page=2#top"), "item")
+        self.assertEqual(self.find("/page/", "https://example.com/page?a=1"), "page")
+        self.assertIsNone(self.find("/page/", "https://example.com/page/other"))
+
+    def test_longest_prefix(self):
+        self.assertIsNone(self.find("/news/item/123"))
+        self.assertEqual(self.find("/news/item/123/", prefix=True), "item")
+        self.assertEqual(self.find("/news/items?page=2", prefix=True), "news")
+        self.assertEqual(self.find("/news/1", "/news/item/1", prefix=True), "item")
+        # exact match wins, root and absolute urls are not prefixes
+        self.assertEqual(self.find("/news/", "/news/item/1", prefix=True), "news")
+        self.assertIsNone(self.find("/newsletter/", prefix=True))
+        self.assertIsNone(self.find("https://example.com/page/1", prefix=True))
+
+    @override_settings(TREE_MENU_URL_PREFIX_MATCH=True)
+    def test_current_item(self):
+        import_menu(
+            "main",
+            [
+                {
+                    "name": "news",
+                    "url": "/news/",
+                    "children": [{"name": "item", "url": "/news/item/"}],
+                }
+            ],
+        )
+        html: str = TreeMenuService(
+            "main", RequestFactory().get("/news/item/123", {"page": 2})
+        ).render_menu()
+        self.assertIn('<span class="current"><a href="/news/item/">', html)
+
+
+class DrawMenuTagTest(TestCase):
+    def setUp(self):
+        clear_menu_caches()
+        menu = import_menu("main", [])
+        # model validators are not run by create, markup can be saved by any client
+        TreeMenuItem.objects.create(
+            name="<script>",
+            url='/a/?x=1&y="2"',
+            parent=TreeMenuItem.objects.get(menu=menu, parent=None),
+            menu=menu,
+        )
+
+    def draw_menu(self) -> str:
+        return Template('{% load tree_menu_tags %}{% draw_menu "main" %}').render(
+            RequestContext(RequestFactory().get("/"))
+        )
+
+    def test_escape(self):
+        for setting in (None, "tree_menu.html"):
+            with self.subTest(template=setting), override_settings(
+                TREE_MENU_TEMPLATE=setting
+            ):
+                html: str = self.draw_menu()
+                self.assertIn(
+                    '<a href="/a/?x=1&amp;y=&quot;2&quot;">&lt;script&gt;</a>', html
+                )
+                self.assertNotIn("<script>", html)
+
+
+class RenderQueryPlanTest(TestCase):
+    """Items of menus for render are read by index in tree order without sorting."""
+
+    indexes = {
+        NESTED_SET_STORAGE: "tree_menu_item_menu_left",
+        MATERIALIZED_PATH_STORAGE: "tree_menu_item_menu_path",
+    }
+
+    def setUp(self):
+        import_menu("main", [{"name": "news", "url": "news", "children": []}])
+
+    def assertRenderQueryUsesIndexes(self, sort_marker: str = ""):
+        for storage, index in self.indexes.items():
+            with self.subTest(storage=storage), override_settings(
+                TREE_MENU_STORAGE=storage
+            ):
+                plan: str = TreeMenuService._get_queryset(["main"]).explain()
+                self.assertIn(index, plan)
+                if sort_marker:
+                    self.assertNotIn(sort_marker, plan)
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite query plan")
+    def test_sqlite(self):
+        self.assertRenderQueryUsesIndexes(sort_marker="TEMP B-TREE")
+
+    @skipUnless(connection.vendor == "postgresql", "PostgreSQL query plan")
+    def test_postgresql(self):
+        # test table is small, so sequential scan is cheaper without this
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        self.assertRenderQueryUsesIndexes()
+
+
+@skipUnless(
+    "fork" in multiprocessing.get_all_start_methods(), "Processes are started by fork"
+)
+class MultiProcessVersionTest(TestCase):
+    """Menu changed by other process is rendered after version check of local menu."""
+
+    def setUp(self):
+        cache_dir: str = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        file_cache = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": cache_dir,
+                }
+            },
+            TREE_MENU_VERSION_CHECK_INTERVAL=60,
+        )
+        file_cache.enable()
+        self.addCleanup(file_cache.disable)
+        clear_menu_caches()
+        import_menu("main", [{"name": "news", "url": "news", "children": []}])
+
+    def test_version_from_other_process(self):
+        self.assertIn(">news<", TreeMenuService("main").render_menu())
+        # change without invalidation, as other process changes database
+        TreeMenuItem.objects.filter(name="news").update(name="events")
+
+        process = multiprocessing.get_context("fork").Process(
+            target=invalidate_menu, args=("main",)
+        )
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+        # local menu is trusted until VERSION_CHECK_INTERVAL passes
+        self.assertIn(">news<", TreeMenuService("main").render_menu())
+        with override_settings(TREE_MENU_VERSION_CHECK_INTERVAL=0):
+            self.assertIn(">events<", TreeMenuService("main").render_menu())
+
+
+class LazyMenuTest(TestCase):
+    def setUp(self):
+        clear_menu_caches()
+        import_menu(
+            "main",
+            [
+                {
+                    "name": "a",
+                    "url": "/a/",
+                    "children": [
+                        {
+                            "name": "a1",
+                            "url": "/a/1/",
+                            "children": [
+                                {
+                                    "name": "a11",
+                                    "url": "/a/1/1/",
+                                    "children": [{"name": "a111", "url": "/a/1/1/1/"}],
+                                }
+                            ],
+                        },
+                        {"name": "a2", "url": "/a/2/"},
+                        {"name": "a3", "url": "/a/3/"},
+                    ],
+                },
+                {"name": "b", "url": "/b/"},
+                {"name": "c", "url": "/c/"},
+            ],
+        )
+        self.ids: dict = dict(
+            TreeMenuItem.objects.filter(menu__name="main").values_list("name", "id")
+        )
+
+    def render(self, url: str, **options) -> str:
+        return TreeMenuService(
+            "main", RequestFactory().get(url), **options
+        ).render_menu()
+
+    def more(self, name: str, offset: int) -> str:
+        return f'data-parent="{self.ids[name]}" data-offset="{offset}"'
+
+    def test_max_depth(self):
+        html: str = self.render("/a/", max_depth=1)
+        self.assertIn('<span class="current"><a href="/a/">', html)
+        self.assertIn(self.more("a", 0), html)
+        self.assertNotIn(">a1<", html)
+
+        # expanded branch of current item is rendered below max_depth
+        html = self.render("/a/1/1/1/", max_depth=2)
+        self.assertIn('<span class="current"><a href="/a/1/1/1/">', html)
+        self.assertIn(">a2<", html)
+        self.assertNotIn(self.more("a11", 0), html)
+        self.assertIn(self.more("a", 0), self.render("/a/1/1/1/", max_depth=1))
+
+    def test_max_siblings(self):
+        html: str = self.render("/", max_siblings=2)
+        self.assertIn(">b<", html)
+        self.assertNotIn(">c<", html)
+        self.assertIn(self.more("main", 2), html)
+
+        # expanded child is rendered after max_siblings children
+        html = self.render("/a/3/", max_siblings=1)
+        self.assertIn('<span class="current"><a href="/a/3/">', html)
+        self.assertNotIn(">a2<", html)
+        self.assertIn(self.more("a", 1), html)
+
+    def test_visible_items(self):
+        request = RequestFactory().get("/a/1/1/")
+        # items of menu not loaded for request are loaded by visible items only
+        with self.assertNumQueries(2):
+            html: str = TreeMenuService(
+                "main", request, max_depth=1, max_siblings=2
+            ).render_menu()
+        with self.assertNumQueries(0):
+            TreeMenuService("main", request, max_depth=1, max_siblings=2).render_menu()
+
+        urls: list = list(
+            TreeMenuItem.objects.filter(menu__name="main").values_list("url", flat=True)
+        )
+        for url in ["/", "/x/", *urls]:
+            for max_depth, max_siblings in ((1, None), (2, 1), (None, 2), (3, 2)):
+                with self.subTest(
+                    url=url, max_depth=max_depth, max_siblings=max_siblings
+                ):
+                    request = RequestFactory().get(url)
+                    menus: dict = TreeMenuService.load_menus(request, ["main"])
+                    self.assertEqual(
+                        self.render(
+                            url, max_depth=max_depth, max_siblings=max_siblings
+                        ),
+                        TreeMenuService(
+                            "main",
+                            request,
+                            menus=menus,
+                            max_depth=max_depth,
+                            max_siblings=max_siblings,
+                        ).render_menu(),
+                    )
+        self.assertIn('class="current"', html)
+
+    def test_menu_children(self):
+        url: str = reverse("tree_menu_children", args=[self.ids["a"]])
+        self.assertEqual(
+            self.client.get(url, {"limit": 2}).json(),
+            {
+                "items": [
+                    {
+                        "id": self.ids["a1"],
+                        "name": "a1",
+                        "url": "/a/1/",
+                        "has_children": True,
+                    },
+                    {
+                        "id": self.ids["a2"],
+                        "name": "a2",
+                        "url": "/a/2/",
+                        "has_children": False,
+                    },
+                ],
+                "next_offset": 2,
+            },
+        )
+        data: dict = self.client.get(url, {"offset": 2, "limit": 2}).json()
+        self.assertEqual([item["name"] for item in data["items"]], ["a3"])
+        self.assertIsNone(data["next_offset"])
+        self.assertEqual(self.client.get(url, {"offset": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"limit": 0}).status_code, 400)
+
+
+class RestructureMenuViewTest(TestCase):
+    def setUp(self):
+        clear_menu_caches()
+        self.menu = import_menu(
+            "main",
+            [
+                {"name": "a", "url": "/a/", "children": []},
+                {"name": "b", "url": "/b/", "children": []},
+            ],
+        )
+        self.a, self.b = TreeMenuItem.objects.filter(menu=self.menu, level=1)
+        self.client.force_login(
+            get_user_model().objects.create_superuser("admin", "", "admin")
+        )
+        self.url = reverse("admin:tree_menu_treemenuitem_tree", args=[self.menu.pk])
+
+    def post(self, items) -> int:
+        return self.client.post(
+            self.url, {"items": items}, content_type="application/json"
+        ).status_code
+
+    def test_restructure(self):
+        self.assertEqual(
+            self.post([{"id": self.a.pk, "children": [{"id": self.b.pk}]}]), 200
+        )
+        self.b.refresh_from_db()
+        self.assertEqual((self.b.parent_id, self.b.level), (self.a.pk, 2))
+
+    def test_invalid_ids(self):
+        for pk in ([self.a.pk], {"id": self.a.pk}, True, float(self.a.pk), None):
+            with self.subTest(pk=pk):
+                self.assertEqual(
+                    self.post([{"id": pk, "children": [{"id": self.b.pk}]}]), 400
+                )
+
+    def test_outline(self):
+        self.assertEqual(
+            self.client.get(self.url).json(),
+            {
+                "items": [
+                    {"id": self.a.pk, "name": "a", "children": []},
+                    {"id": self.b.pk, "name": "b", "children": []},
+                ]
+            },
+        )
+
+    def test_missing_menu(self):
+        self.url = reverse("admin:tree_menu_treemenuitem_tree", args=[self.menu.pk + 1])
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.post([]), 404)
+
+
+@mock.patch.object(TreeMenuItemsAdmin, "list_per_page", 2)
+class TreeChangeListTest(TestCase):
+    def setUp(self):
+        for name in ("main", "other"):
+            import_menu(
+                name,
+                [
+                    {
+                        "name": "a",
+                        "url": f"/{name}/a/",
+                        "children": [
+                            {"name": "a1", "url": f"/{name}/a/1/"},
+                            {"name": "a2", "url": f"/{name}/a/2/"},
+                        ],
+                    },
+                    {"name": "b", "url": f"/{name}/b/"},
+                ],
+            )
+        self.client.force_login(
+            get_user_model().objects.create_superuser("admin", "", "admin")
+        )
+        self.url = reverse("admin:tree_menu_treemenuitem_changelist")
+
+    def get_changelist(self, query_string: str = ""):
+        response = self.client.get(self.url + query_string)
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"]
+
+    def test_keyset_pages(self):
+        storage = TreeMenuItem.get_storage()
+        items: list = list(
+            TreeMenuItem.objects.filter(parent__isnull=False)
+            .order_by("menu_id", *storage.order_fields)
+            .values_list("pk", flat=True)
+        )
+        pages: list = []
+        query_string: Optional[str] = ""
+        while query_string is not None:
+            with CaptureQueriesContext(connection) as queries:
+                changelist = self.get_changelist(query_string)
+            self.assertFalse(
+                [query for query in queries if "OFFSET" in query["sql"].upper()]
+            )
+            pages.append([item.pk for item in changelist.result_list])
+            query_string = changelist.next_page_url
+        self.assertEqual([pk for page in pages for pk in page], items)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 2])
+        self.assertIsNotNone(changelist.first_page_url)
+
+    def test_collapsed(self):
+        a = TreeMenuItem.objects.get(menu__name="main", name="a")
+        changelist = self.get_changelist(f"?menu__id__exact={a.menu_id}")
+        self.assertEqual([item.name for item in changelist.result_list], ["a", "a1"])
+        collapse_url: str = changelist.result_list[0].collapse_url
+        self.assertIsNone(changelist.result_list[1].collapse_url)
+
+        changelist = self.get_changelist(collapse_url)
+        self.assertEqual([item.name for item in changelist.result_list], ["a", "b"])
+        self.assertIsNone(changelist.next_page_url)
+        # the same link expands subtree again
+        changelist = self.get_changelist(changelist.result_list[0].collapse_url)
+        self.assertEqual([item.name for item in changelist.result_list], ["a", "a1"])
+
+    @mock.patch.object(EstimatedCountPaginator, "count_limit", 3)
+    def test_estimated_count(self):
+        response = self.client.get(self.url)
+        changelist = response.context["cl"]
+        self.assertEqual(changelist.result_count, 3)
+        self.assertTrue(changelist.paginator.estimated)
+        self.assertContains(response, "3+ tree menu items")
+
+        changelist = self.get_changelist("?q=a1")
+        self.assertEqual(changelist.result_count, 2)
+        self.assertFalse(changelist.paginator.estimated)
+
+
+class PrerenderedMenuTest(TestCase):
+    def setUp(self):
+        clear_menu_caches()
+        import_menu("main", [{"name": "news", "url": "news", "children": []}])
+        self.directory: str = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        prerendered = override_settings(
+            TREE_MENU_PRERENDERED=True, TREE_MENU_PRERENDERED_DIR=self.directory
+        )
+        prerendered.enable()
+        self.addCleanup(prerendered.disable)
+
+    def render(self) -> tuple:
+        """Return html of menu for news page and source of loaded menu."""
+        sources: list = []
+
+        def receiver(phase, menu_names, cache=None, **kwargs):
+            if phase == "load" and cache:
+                sources.append(cache["main"])
+
+        menu_metrics.connect(receiver)
+        try:
+            html: str = TreeMenuService(
+                "main", RequestFactory().get("/example/news")
+            ).render_menu()
+        finally:
+            menu_metrics.disconnect(receiver)
+        return html, sources[-1]
+
+    def test_prerender_again(self):
+        for _ in range(2):
+            call_command("prerender_menus", "-o", self.directory, stdout=StringIO())
+        html, source = self.render()
+        self.assertIn('class="current"', html)
+        self.assertEqual(source, "prerendered")
+
+    def test_file_after_cache_flush(self):
+        call_command("prerender_menus", "-o", self.directory, stdout=StringIO())
+        # new versions of menus are created after flush, file is checked by content
+        clear_menu_caches()
+        self.assertEqual(self.render()[1], "prerendered")
+        self.assertEqual(self.render()[1], "prerendered")
+
+        # change without invalidation and flush, as restart after change of database
+        TreeMenuItem.objects.filter(name="news").update(name="events")
+        clear_menu_caches()
+        html, source = self.render()
+        self.assertEqual(source, "missing")
+        self.assertIn(">events<", html)
+
+    def test_load_menus(self):
+        call_command("prerender_menus", "-o", self.directory, stdout=StringIO())
+        sources: list = []
+
+        def receiver(phase, menu_names, cache=None, **kwargs):
+            if phase == "load" and cache:
+                sources.append(cache["main"])
+
+        menu_metrics.connect(receiver)
+        self.addCleanup(menu_metrics.disconnect, receiver)
+        template = Template(
+            '{% load tree_menu_tags %}{% load_menus "main" %}{% draw_menu "main" %}'
+        )
+        for _ in range(2):
+            sources.clear()
+            html: str = template.render(
+                RequestContext(RequestFactory().get("/example/news"))
+            )
+        self.assertIn('class="current"', html)
+        # first render checks file by loaded menu, then load_menus loads nothing
+        self.assertEqual(sources, ["prerendered"])
+
+    def test_not_shared_cache(self):
+        with self.assertRaises(CommandError):
+            call_command("prerender_menus", stdout=StringIO())
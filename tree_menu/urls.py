@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .views import menu_children
+
+urlpatterns = [
+    path("children/<int:item_id>/", menu_children, name="tree_menu_children"),
+]
@@ -1,3 +1,25 @@
-from django.shortcuts import render
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from .services.tree_menu import get_menu_children
+
+# max count of children in one response
+CHILDREN_LIMIT = 200
+
+
+@require_GET
+def menu_children(request, item_id: int):
+    """Return children of menu item as json, it is used by lazy expanded menus.
+
+    GET params: offset and limit of children page.
+    """
+    try:
+        offset = int(request.GET.get("offset", 0))
+        limit = int(request.GET.get("limit", 50))
+    except ValueError:
+        return HttpResponseBadRequest("offset and limit have to be integers")
+    if offset < 0 or limit < 1:
+        return HttpResponseBadRequest("offset and limit have to be positive")
+    return JsonResponse(
+        get_menu_children(item_id, offset=offset, limit=min(limit, CHILDREN_LIMIT))
+    )